@@ -1,14 +1,28 @@
+import time
+
+# set before the other imports so the "Started in" line covers them, the
+# Slack App's auth.test and the rest of module setup, up to connecting
+STARTED = time.perf_counter()
+
+import json
 import random
-import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from os import getenv
 
-import requests
+from dedup import claim, retry_num
 from dotenv import load_dotenv
-from langfuse import observe
+from history import append_channel_history, history_stats, recent_history
+import ratelimit
+from reactions import REACTION_FORMATS, parse_json_reply, plain_reply, split_reaction_header
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
-from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
 from tomnook import QUOTES
+from tracing import observe
+from transport import http_session
+from triggers import compile_router, route
 
 # SET UP TOKENS AND CONSTANTS
 load_dotenv()
@@ -18,6 +32,19 @@ APP_TOKEN = getenv("APP_TOKEN")
 
 HACKCLUB_AI_KEY = getenv("HACKCLUB_AI_KEY")
 MODEL = "google/gemini-2.5-flash"
+COMPLETIONS_URL = "https://ai.hackclub.com/proxy/v1/chat/completions"
+
+# stream replies into a placeholder message instead of waiting for the whole
+# completion; chat.update is rate limited (tier 3), so edits are throttled per
+# message and share one process-wide token bucket with every other stream
+STREAM_REPLIES = getenv("STREAM_REPLIES", "1") != "0"
+STREAM_PLACEHOLDER = "typing..."
+STREAM_UPDATE_INTERVAL = 1.0  # min seconds between edits of one message
+STREAM_READ_TIMEOUT = 15  # max seconds of silence from the stream
+
+# have the reply call also pick the reaction emoji, instead of a second call
+# that resends the whole emoji list; get_ai_chosen_emoji is the fallback
+COMBINED_REACTIONS = getenv("COMBINED_REACTIONS", "1") != "0"
 
 ALLOWED_CHANNELS = [
     "C0A1XK69529",
@@ -84,55 +111,14 @@ emoji_list = [
     "blunder",
     "brilliant-move",
 ]
+EMOJI_SET = set(emoji_list)
 
 app = App(token=SLACK_TOKEN)
 
-# Message history per channel (max 100 messages each)
-MESSAGE_HISTORY = {}
-
-
-def load_channel_history(channel):
-    """Load message history for a specific channel from file."""
-    try:
-        with open(f"/app/data/channel_history_{channel}.txt", "r") as f:
-            messages = [line.strip() for line in f.readlines() if line.strip()]
-            return messages[-100:]  # Keep only last 100
-    except FileNotFoundError:
-        return []
-
-
-def save_channel_history(channel, messages):
-    """Save message history for a specific channel to file."""
-    import os
-
-    os.makedirs("/app/data", exist_ok=True)
-    try:
-        with open(f"/app/data/channel_history_{channel}.txt", "w") as f:
-            for msg in messages[-100:]:  # Save only last 100
-                f.write(f"{msg}\n")
-    except Exception as e:
-        print(f"Failed to save history for {channel}: {e}")
-
-
-# Load existing histories on startup
-import glob
-
-for history_file in glob.glob("/app/data/channel_history_*.txt"):
-    try:
-        channel = history_file.replace("/app/data/channel_history_", "").replace(
-            ".txt", ""
-        )
-        MESSAGE_HISTORY[channel] = load_channel_history(channel)
-        print(f"Loaded {len(MESSAGE_HISTORY[channel])} messages for channel {channel}")
-    except Exception as e:
-        print(f"Failed to load {history_file}: {e}")
-
-
 def get_thread_context(channel, thread_ts):
     """Fetch all messages in a thread for context."""
     try:
-        client = WebClient(token=SLACK_TOKEN)
-        response = client.conversations_replies(
+        response = app.client.conversations_replies(
             channel=channel, ts=thread_ts, limit=50  # Get up to 50 messages in thread
         )
 
@@ -158,17 +144,8 @@ def process_message(geoff, body, say):
         if user not in BANNED_USERS:
             text = body["event"]["text"]
 
-            # Initialize channel history if needed
-            if channel not in MESSAGE_HISTORY:
-                MESSAGE_HISTORY[channel] = load_channel_history(channel)
-
-            # Add message to channel-specific history and maintain 100 message limit
-            MESSAGE_HISTORY[channel].append(text)
-            if len(MESSAGE_HISTORY[channel]) > 100:
-                MESSAGE_HISTORY[channel] = MESSAGE_HISTORY[channel][-100:]
-
-            # Save updated history to file
-            save_channel_history(channel, MESSAGE_HISTORY[channel])
+            # Add message to channel-specific history (last HISTORY_SIZE kept)
+            append_channel_history(channel, text)
 
             # Get thread context if this is part of a thread
             thread_context = []
@@ -179,20 +156,25 @@ def process_message(geoff, body, say):
             else:
                 reply_ts = event_ts  # Start a new thread
 
-            if geoff:
-                reply = get_geoff_reply(user, text, channel, thread_context)
-            else:
-                reply = get_sarcastic_reply(user, text, channel, thread_context)
-            say(text=reply, thread_ts=reply_ts)
+            chosen = {}
+
+            def generate(on_delta=None):
+                reply, chosen["emoji"] = generate_reply(
+                    geoff, user, text, channel, thread_context, on_delta
+                )
+                return reply
 
-            # reactions
-            client = WebClient(token=SLACK_TOKEN)
+            if STREAM_REPLIES:
+                stream_reply(say, channel, reply_ts, generate)
+            else:
+                say(text=generate(), thread_ts=reply_ts)
 
-            emoji_choice = get_ai_chosen_emoji(text, emoji_list)
+            # reactions: picked by the reply call, or by a call of its own if it did not
+            emoji_choice = chosen.get("emoji") or get_ai_chosen_emoji(text, emoji_list)
 
             if emoji_choice in emoji_list:
                 try:
-                    client.reactions_add(
+                    app.client.reactions_add(
                         channel=channel, name=emoji_choice, timestamp=event_ts
                     )
                 except Exception as e:
@@ -204,15 +186,129 @@ def process_message(geoff, body, say):
             )
 
 
+def generate_reply(geoff, user, text, channel, thread_context, on_delta=None):
+    """Return (reply, emoji) for a message, with the emoji picked in the same call.
+
+    emoji is None when it could not be (COMBINED_REACTIONS off, or the model
+    did not name one from emoji_list), so the caller can ask for one separately.
+    """
+    get_reply = get_geoff_reply if geoff else get_sarcastic_reply
+    if not COMBINED_REACTIONS:
+        return get_reply(user, text, channel, thread_context, on_delta), None
+
+    if on_delta is not None:
+
+        def show(raw):
+            reply, _ = split_reaction_header(raw)
+            if reply:
+                on_delta(reply)
+
+        raw = get_reply(user, text, channel, thread_context, show, reaction_format="header")
+        reply, emoji = split_reaction_header(raw)
+        if not reply:
+            reply, emoji = raw, None
+    else:
+        raw = get_reply(user, text, channel, thread_context, reaction_format="json")
+        reply, emoji = parse_json_reply(raw)
+        if reply is None:
+            # not the JSON we asked for: the text is still the reply, and the
+            # caller picks the reaction separately
+            reply, emoji = plain_reply(raw), None
+
+    if isinstance(emoji, str):
+        emoji = emoji.strip().strip(":")
+    return reply, emoji if emoji in EMOJI_SET else None
+
+
+def stream_reply(say, channel, thread_ts, generate):
+    """Post a placeholder, then edit it as `generate(on_delta)` streams the reply."""
+    posted = say(text=STREAM_PLACEHOLDER, thread_ts=thread_ts)
+    ts = posted.get("ts") if posted else None
+    shown = {"text": STREAM_PLACEHOLDER, "at": time.monotonic()}
+
+    def update(text):
+        # a failed edit still counts towards the throttle, but only text that
+        # actually landed counts as shown, so the final edit is not skipped
+        shown["at"] = time.monotonic()
+        try:
+            app.client.chat_update(channel=channel, ts=ts, text=text)
+            shown["text"] = text
+            return True
+        except SlackApiError as e:
+            if e.response.status_code == 429:
+                retry_after = (e.response.headers or {}).get("Retry-After") or 1
+                ratelimit.block("chat_update", float(retry_after))
+            print("Failed to update streamed reply:", e)
+        except Exception as e:
+            print("Failed to update streamed reply:", e)
+        return False
+
+    def on_delta(text):
+        # without a free token the edit is skipped; the next delta carries the
+        # text so far, so skipped deltas coalesce into the next edit
+        if not ts or not text.strip() or time.monotonic() - shown["at"] < STREAM_UPDATE_INTERVAL:
+            return
+        if ratelimit.acquire("chat_update", wait=False):
+            update(text)
+
+    reply = generate(on_delta)
+    if not ts:
+        say(text=reply, thread_ts=thread_ts)
+    elif reply != shown["text"]:
+        # the final text must land, so wait for a token (once more after a 429)
+        for _ in range(2):
+            ratelimit.acquire("chat_update")
+            if update(reply):
+                break
+    return reply
+
+
+def stream_chat_completion(prompt, on_delta):
+    """Stream a chat completion, calling `on_delta` with the text so far."""
+    chunks = []
+    with http_session.post(
+        COMPLETIONS_URL,
+        headers={
+            "Authorization": f"Bearer {HACKCLUB_AI_KEY}",
+            "Content-Type": "application/json",
+        },
+        json={
+            "model": MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": True,
+        },
+        stream=True,
+        timeout=STREAM_READ_TIMEOUT,
+    ) as r:
+        r.raise_for_status()
+        r.encoding = "utf-8"  # text/event-stream usually comes without a charset
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or []
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                chunks.append(delta)
+                on_delta("".join(chunks))
+    if not chunks:
+        raise ValueError("empty completion stream")
+    return "".join(chunks)
+
+
 @observe
-def get_geoff_reply(user, message_text, channel, thread_context=None):
-    # Get channel-specific message history (last 100 messages)
-    past_messages = MESSAGE_HISTORY.get(channel, [])
+def get_geoff_reply(
+    user, message_text, channel, thread_context=None, on_delta=None, reaction_format=None
+):
+    # Get channel-specific message history (last 20 messages)
+    past_messages = recent_history(channel)
 
     # Build context string with both channel history and thread context
     context_parts = []
     if past_messages:
-        context_parts.append(f"Recent channel messages: {past_messages[-20:]}")
+        context_parts.append(f"Recent channel messages: {past_messages}")
 
     if thread_context:
         context_parts.append(f"Thread conversation: {thread_context}")
@@ -234,11 +330,19 @@ def get_geoff_reply(user, message_text, channel, thread_context=None):
         {"The message you're receiving is from one of the owners of this bot. Please be slightly kinder to them and treat them as your maintainer/owner." if user in ADMINS else ""}
         Go ahead and respond to the user's message!
         """
+        + REACTION_FORMATS.get(reaction_format, "")
         + f"user message: {message_text}"
     )
 
-    r = requests.post(
-        "https://ai.hackclub.com/proxy/v1/chat/completions",
+    if on_delta is not None:
+        try:
+            return stream_chat_completion(prompt, on_delta)
+        except Exception as e:
+            print("error: ", e)
+            return "Im broken inside lol :( - dm the maintainers"
+
+    r = http_session.post(
+        COMPLETIONS_URL,
         headers={
             "Authorization": f"Bearer {HACKCLUB_AI_KEY}",
             "Content-Type": "application/json",
@@ -246,6 +350,7 @@ def get_geoff_reply(user, message_text, channel, thread_context=None):
         json={
             "model": MODEL,
             "messages": [{"role": "user", "content": prompt}],
+            **({"response_format": {"type": "json_object"}} if reaction_format == "json" else {}),
         },
         timeout=15,
     )
@@ -270,14 +375,16 @@ def get_geoff_reply(user, message_text, channel, thread_context=None):
 
 
 @observe
-def get_sarcastic_reply(user, message_text, channel, thread_context=None):
-    # Get channel-specific message history (last 100 messages)
-    past_messages = MESSAGE_HISTORY.get(channel, [])
+def get_sarcastic_reply(
+    user, message_text, channel, thread_context=None, on_delta=None, reaction_format=None
+):
+    # Get channel-specific message history (last 20 messages)
+    past_messages = recent_history(channel)
 
     # Build context string with both channel history and thread context
     context_parts = []
     if past_messages:
-        context_parts.append(f"Recent channel messages: {past_messages[-20:]}")
+        context_parts.append(f"Recent channel messages: {past_messages}")
 
     if thread_context:
         context_parts.append(f"Thread conversation: {thread_context}")
@@ -312,11 +419,19 @@ def get_sarcastic_reply(user, message_text, channel, thread_context=None):
         {"The message you're receiving is from one of the owners of this bot. Please be slightly kinder to them and treat them as your maintainer/owner." if user in ADMINS else ""}
         Go ahead and respond to the user's message!
         """
+        + REACTION_FORMATS.get(reaction_format, "")
         + f"user message: {message_text}"
     )
 
-    r = requests.post(
-        "https://ai.hackclub.com/proxy/v1/chat/completions",
+    if on_delta is not None:
+        try:
+            return stream_chat_completion(prompt, on_delta)
+        except Exception as e:
+            print("error: ", e)
+            return "Im broken inside lol :( - dm the maintainers"
+
+    r = http_session.post(
+        COMPLETIONS_URL,
         headers={
             "Authorization": f"Bearer {HACKCLUB_AI_KEY}",
             "Content-Type": "application/json",
@@ -324,6 +439,7 @@ def get_sarcastic_reply(user, message_text, channel, thread_context=None):
         json={
             "model": MODEL,
             "messages": [{"role": "user", "content": prompt}],
+            **({"response_format": {"type": "json_object"}} if reaction_format == "json" else {}),
         },
         timeout=15,
     )
@@ -356,8 +472,8 @@ def get_ai_chosen_emoji(message_text, emoji_list):
     user message: {message_text}
     """
 
-    r = requests.post(
-        "https://ai.hackclub.com/proxy/v1/chat/completions",
+    r = http_session.post(
+        COMPLETIONS_URL,
         headers={
             "Authorization": f"Bearer {HACKCLUB_AI_KEY}",
             "Content-Type": "application/json",
@@ -381,8 +497,67 @@ def get_ai_chosen_emoji(message_text, emoji_list):
 
 # EVENTS / SOCKET STUFF
 
-# Track processed messages to prevent duplicate responses
-PROCESSED_MESSAGES = set()
+# listeners only ack and queue; replies are generated on this pool. Work for one
+# thread runs one message at a time, in arrival order, so replies stay in order.
+WORKERS = int(getenv("GREG_WORKERS", "8"))
+MAX_PENDING = 500  # queued messages beyond this are dropped rather than piling up
+DISPATCH_STATS_INTERVAL = 60 * 10  # seconds between queue-depth lines in the log
+
+worker_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="greg")
+_thread_queues = {}  # (channel, thread ts) -> deque of queued work
+_dispatch_lock = threading.Lock()
+DISPATCH_STATS = {"pending": 0, "running": 0, "max_pending": 0, "done": 0, "dropped": 0}
+_dispatch_logged = time.time()
+
+
+def dispatch_stats():
+    with _dispatch_lock:
+        return dict(DISPATCH_STATS, threads=len(_thread_queues))
+
+
+def dispatch(key, fn, *args):
+    """Queue `fn(*args)` behind any earlier work for the same thread."""
+    global _dispatch_logged
+    with _dispatch_lock:
+        if DISPATCH_STATS["pending"] >= MAX_PENDING:
+            DISPATCH_STATS["dropped"] += 1
+            print(f"Dispatch queue full, dropping message for {key}")
+            return
+        DISPATCH_STATS["pending"] += 1
+        DISPATCH_STATS["max_pending"] = max(DISPATCH_STATS["max_pending"], DISPATCH_STATS["pending"])
+        work = _thread_queues.get(key)
+        start = work is None
+        if start:
+            work = _thread_queues[key] = deque()
+        work.append((fn, args))
+        log = time.time() - _dispatch_logged >= DISPATCH_STATS_INTERVAL
+        if log:
+            _dispatch_logged = time.time()
+    if start:
+        worker_pool.submit(_drain_thread, key)
+    if log:
+        print("Dispatch:", dispatch_stats())
+        print("History:", history_stats())
+
+
+def _drain_thread(key):
+    while True:
+        with _dispatch_lock:
+            work = _thread_queues[key]
+            if not work:
+                del _thread_queues[key]
+                return
+            fn, args = work.popleft()
+            DISPATCH_STATS["pending"] -= 1
+            DISPATCH_STATS["running"] += 1
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"Failed to handle message for {key}:", e)
+        finally:
+            with _dispatch_lock:
+                DISPATCH_STATS["running"] -= 1
+                DISPATCH_STATS["done"] += 1
 
 
 @app.command("/acnhquote")
@@ -398,72 +573,62 @@ def acnh_quote(ack, body, client):
     )
 
 
-# Combined pattern for all trigger words
-greg_trigger_pattern = re.compile(
-    r"assistant|greg|unwanted ai|slack annoyance|slave|servant|clanker|clanka|grok is this true",
-    re.IGNORECASE,
-)
+# greg's and geoff's trigger words in one pattern, so each message is scanned once
+trigger_router = compile_router("greg", "geoff")
 
 
-@app.message(greg_trigger_pattern)
 @app.event("app_mention")
-def on_pinged(ack, body, say):
+def on_pinged(ack, body, say, request):
     ack()
 
-    # Create unique message ID to prevent duplicate processing
-    message_id = f"{body['event']['channel']}_{body['event']['ts']}"
-
-    if message_id not in PROCESSED_MESSAGES:
-        PROCESSED_MESSAGES.add(message_id)
-
-        # Keep only last 1000 processed messages to prevent memory growth
-        if len(PROCESSED_MESSAGES) > 1000:
-            PROCESSED_MESSAGES.clear()
+    # Create unique message ID to prevent duplicate processing (see dedup.py)
+    event = body["event"]
+    message_id = f"{event['channel']}_{event['ts']}"
+    if not claim(message_id, retry_num(request.headers, body)):
+        return
 
-        process_message(False, body, say)
+    dispatch(
+        (event["channel"], event.get("thread_ts") or event["ts"]),
+        process_message,
+        False,
+        body,
+        say,
+    )
 
 
-@app.message(re.compile("geoff", re.IGNORECASE))
-def geoff(ack, body, say):
+@app.event("message")
+def on_message(ack, event, body, say, request):
+    """Route every message with one scan: greg triggers, then geoff, then plain DMs."""
     ack()
 
-    # Create unique message ID to prevent duplicate processing
-    message_id = f"{body['event']['channel']}_{body['event']['ts']}"
-
-    if message_id not in PROCESSED_MESSAGES:
-        PROCESSED_MESSAGES.add(message_id)
-
-        # Keep only last 1000 processed messages to prevent memory growth
-        if len(PROCESSED_MESSAGES) > 1000:
-            PROCESSED_MESSAGES.clear()
-
-        process_message(True, body, say)
-
-
-@app.event("message")
-def handle_dm(event, body, say):
-    """Handle DM messages - respond to all DMs without needing trigger words."""
-    channel_type = event.get("channel_type", "")
-    if channel_type != "im":
+    if event.get("bot_id") or event.get("subtype") not in (None, "file_share", "thread_broadcast"):
         return
 
-    if event.get("bot_id") or event.get("subtype"):
+    personas = route(trigger_router, event.get("text", ""))
+    if "greg" in personas:
+        geoff = False
+    elif "geoff" in personas:
+        geoff = True
+    elif event.get("channel_type") == "im":
+        # DMs get a reply without needing trigger words
+        geoff = False
+    else:
         return
 
+    # Create unique message ID to prevent duplicate processing (see dedup.py)
     message_id = f"{event['channel']}_{event['ts']}"
-    if message_id in PROCESSED_MESSAGES:
+    if not claim(message_id, retry_num(request.headers, body)):
         return
 
-    PROCESSED_MESSAGES.add(message_id)
-    if len(PROCESSED_MESSAGES) > 1000:
-        PROCESSED_MESSAGES.clear()
-
-    text = event.get("text", "")
-    if re.search(r"geoff", text, re.IGNORECASE):
-        process_message(True, body, say)
-    else:
-        process_message(False, body, say)
+    dispatch(
+        (event["channel"], event.get("thread_ts") or event["ts"]),
+        process_message,
+        geoff,
+        body,
+        say,
+    )
 
 
 if __name__ == "__main__":
+    print(f"Started in {time.perf_counter() - STARTED:.2f}s, history: {history_stats()}")
     SocketModeHandler(app, APP_TOKEN).start()
@@ -0,0 +1,118 @@
+import json
+import os
+import resource
+import threading
+from collections import OrderedDict, deque
+from os import getenv
+
+# Message history per channel: the last HISTORY_SIZE messages in a ring buffer,
+# persisted as an append-only JSON-lines log (one JSON string per line, so
+# messages with newlines survive) that is rewritten from the buffer once it has
+# collected HISTORY_SIZE appends.
+# Histories are loaded the first time a channel needs one and at most
+# MAX_RESIDENT_CHANNELS stay in memory; the least recently used is dropped
+# (its log on disk is always current, so nothing has to be written out).
+HISTORY_DIR = "/app/data"
+HISTORY_SIZE = 100
+MAX_RESIDENT_CHANNELS = 200  # default for the MAX_RESIDENT_CHANNELS env var
+MESSAGE_HISTORY = OrderedDict()  # channel -> deque, least recently used first
+_history_appends = {}  # channel -> appends since the log was last rewritten
+_history_lock = threading.Lock()
+HISTORY_STATS = {"loads": 0, "evictions": 0}
+
+
+def history_path(channel):
+    return os.path.join(HISTORY_DIR, f"channel_history_{channel}.jsonl")
+
+
+def load_channel_history(channel):
+    """Load message history for a specific channel from file."""
+    history = deque(maxlen=HISTORY_SIZE)
+    try:
+        lines = 0
+        with open(history_path(channel), "r") as f:
+            for line in f:
+                lines += 1
+                try:
+                    history.append(json.loads(line))
+                except ValueError:
+                    continue  # torn write from a crash
+        _history_appends[channel] = max(0, lines - HISTORY_SIZE)
+        return history
+    except FileNotFoundError:
+        pass
+
+    # one-off migration from the old line-per-message .txt file
+    legacy = os.path.join(HISTORY_DIR, f"channel_history_{channel}.txt")
+    try:
+        with open(legacy, "r") as f:
+            history.extend(line.strip() for line in f if line.strip())
+    except FileNotFoundError:
+        return history
+    save_channel_history(channel, history)
+    os.replace(legacy, legacy + ".migrated")
+    return history
+
+
+def save_channel_history(channel, messages):
+    """Rewrite a channel's history log from its buffer."""
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    try:
+        tmp = history_path(channel) + ".tmp"
+        with open(tmp, "w") as f:
+            f.writelines(json.dumps(msg) + "\n" for msg in messages)
+        os.replace(tmp, history_path(channel))
+        _history_appends[channel] = 0
+    except Exception as e:
+        print(f"Failed to save history for {channel}: {e}")
+
+
+def _resident_history(channel):
+    """A channel's history buffer, loading it if needed. Call with _history_lock."""
+    history = MESSAGE_HISTORY.get(channel)
+    if history is not None:
+        MESSAGE_HISTORY.move_to_end(channel)
+        return history
+    history = MESSAGE_HISTORY[channel] = load_channel_history(channel)
+    HISTORY_STATS["loads"] += 1
+    # read here, not on import: greg imports this before load_dotenv()
+    max_resident = int(getenv("MAX_RESIDENT_CHANNELS", MAX_RESIDENT_CHANNELS))
+    while len(MESSAGE_HISTORY) > max_resident:
+        evicted, _ = MESSAGE_HISTORY.popitem(last=False)
+        _history_appends.pop(evicted, None)
+        HISTORY_STATS["evictions"] += 1
+    return history
+
+
+def history_stats():
+    with _history_lock:
+        return dict(
+            HISTORY_STATS,
+            resident_channels=len(MESSAGE_HISTORY),
+            resident_messages=sum(len(h) for h in MESSAGE_HISTORY.values()),
+            resident_chars=sum(len(m) for h in MESSAGE_HISTORY.values() for m in h),
+            peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        )
+
+
+def append_channel_history(channel, text):
+    """Add a message to a channel's history: one line appended to its log."""
+    with _history_lock:
+        _resident_history(channel).append(text)
+
+        appends = _history_appends.get(channel, 0) + 1
+        if appends >= HISTORY_SIZE:
+            save_channel_history(channel, MESSAGE_HISTORY[channel])
+            return
+        _history_appends[channel] = appends
+        os.makedirs(HISTORY_DIR, exist_ok=True)
+        try:
+            with open(history_path(channel), "a") as f:
+                f.write(json.dumps(text) + "\n")
+        except Exception as e:
+            print(f"Failed to save history for {channel}: {e}")
+
+
+def recent_history(channel, n=20):
+    with _history_lock:
+        return list(_resident_history(channel))[-n:]
@@ -0,0 +1,70 @@
+import json
+import re
+
+# How the reply call is asked to return its reaction: JSON when the reply comes
+# back in one piece, a header line when it is streamed so the text can be shown
+# as it arrives. Kept out of greg.py so the parsing can be tested without Slack.
+
+REACTION_FORMATS = {
+    "json": """
+        Also pick EXACTLY ONE emoji name from the emoji list above as the best sarcastic reaction to the user's message.
+        Respond ONLY with a JSON object of the form {"reply": "<your reply>", "reaction": "<emoji name, no colons>"}.
+        """,
+    "header": """
+        Also pick EXACTLY ONE emoji name from the emoji list above as the best sarcastic reaction to the user's message.
+        Start your response with a single line `reaction: <emoji name, no colons>`, then a newline, then your reply.
+        """,
+}
+REACTION_HEADER = re.compile(r"\s*reaction:\s*:?([\w+-]+):?[^\n]*\n", re.IGNORECASE)
+# a JSON string field, for objects that do not parse (cut off, stray text)
+JSON_FIELD = r'"{}"\s*:\s*"((?:[^"\\]|\\.)*)(?:"|$)'
+JSON_REPLY_FIELD = re.compile(JSON_FIELD.format("reply"), re.DOTALL)
+JSON_REACTION_FIELD = re.compile(JSON_FIELD.format("reaction"))
+CODE_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
+def split_reaction_header(text):
+    """Split a streamed `reaction: name` header off a reply.
+
+    Returns (reply, emoji); reply is None while the header is still arriving.
+    """
+    m = REACTION_HEADER.match(text)
+    if m:
+        return text[m.end():].lstrip("\n"), m.group(1)
+    start = text.strip().lower()
+    if "\n" not in text and (start.startswith("reaction:") or "reaction:".startswith(start)):
+        return None, None
+    return text, None
+
+
+def _json_string(escaped):
+    try:
+        return json.loads(f'"{escaped}"')
+    except ValueError:
+        return escaped.replace('\\"', '"').replace("\\n", "\n")
+
+
+def parse_json_reply(raw):
+    """Return (reply, emoji) from a JSON-mode reply, or (None, None) if it is not one.
+
+    An object that does not parse still gives up its "reply" and "reaction"
+    fields if they can be found.
+    """
+    try:
+        # some models still wrap the object in a code fence
+        data = json.loads(raw[raw.index("{") : raw.rindex("}") + 1])
+    except Exception:
+        m = JSON_REPLY_FIELD.search(raw)
+        if not m or not m.group(1).strip():
+            return None, None
+        reaction = JSON_REACTION_FIELD.search(raw)
+        return _json_string(m.group(1)), reaction and _json_string(reaction.group(1))
+    reply = data.get("reply") if isinstance(data, dict) else None
+    if not isinstance(reply, str) or not reply.strip():
+        return None, None
+    return reply, data.get("reaction")
+
+
+def plain_reply(raw):
+    """The raw text of a reply that was not the JSON asked for, minus any code fence."""
+    return CODE_FENCE.sub("", raw).strip()
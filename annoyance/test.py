@@ -1,9 +1,9 @@
-import requests
 from greg import HACKCLUB_AI_KEY, MODEL
+from transport import http_session
 
 prompt = "hi this is a test"
 
-r = requests.post(
+r = http_session.post(
 "https://ai.hackclub.com/proxy/v1/chat/completions",
 headers={
     "Authorization": f"Bearer {HACKCLUB_AI_KEY}",
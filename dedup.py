@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Drops events the bot has already handled, so Slack's retries (and the same
+# message arriving as both `message` and `app_mention`) never reach the model
+# twice. Ids are remembered for DEDUP_TTL in insertion order, so expiring the
+# oldest is O(1), and are kept in an append-only log so a restart does not
+# forget them; the log is rewritten once it holds as many stale lines as live.
+# Shared by greg and both slack id bots; their images copy it from the repo
+# root, which is the build context.
+
+DATA_DIR = "/app/data" if os.path.isdir("/app/data") else os.path.dirname(os.path.abspath(__file__))
+DEDUP_FILE = os.environ.get("DEDUP_FILE", os.path.join(DATA_DIR, "processed_messages.log"))
+DEDUP_TTL = 60 * 60  # Slack gives up retrying an event long before this
+DEDUP_MAX = 10000  # ids kept even if they have not expired yet
+DEDUP_COMPACT_MIN = 1000  # appends before the first rewrite
+
+_seen = OrderedDict()  # id -> time first seen, oldest first
+_lock = threading.Lock()
+_log = None
+_appends = 0
+DEDUP_STATS = {"claimed": 0, "duplicates": 0, "retries": 0, "duplicate_retries": 0}
+
+
+def _expire(now):
+    while _seen:
+        seen_at = next(iter(_seen.values()))
+        if seen_at > now - DEDUP_TTL and len(_seen) <= DEDUP_MAX:
+            return
+        _seen.popitem(last=False)
+
+
+def _compact():
+    global _log, _appends
+    try:
+        if _log:
+            _log.close()
+        tmp = DEDUP_FILE + ".tmp"
+        with open(tmp, "w") as f:
+            f.writelines(f"{seen_at}\t{message_id}\n" for message_id, seen_at in _seen.items())
+        os.replace(tmp, DEDUP_FILE)
+        _log = open(DEDUP_FILE, "a", buffering=1)
+    except Exception as e:
+        _log = None
+        print("Warning: could not save processed messages:", e)
+    _appends = 0
+
+
+def _load():
+    now = time.time()
+    try:
+        with open(DEDUP_FILE, "r") as f:
+            for line in f:
+                seen_at, _, message_id = line.rstrip("\n").partition("\t")
+                try:
+                    _seen.setdefault(message_id, float(seen_at))
+                except ValueError:
+                    continue  # torn write from a crash
+    except FileNotFoundError:
+        pass
+    _expire(now)
+    _compact()
+
+
+def retry_num(headers=None, body=None):
+    """Slack's retry count for an event: x-slack-retry-num, or Socket Mode's retry_attempt."""
+    raw = (headers or {}).get("x-slack-retry-num")
+    if isinstance(raw, (list, tuple)):
+        raw = raw[0] if raw else None
+    if raw is None and body:
+        raw = body.get("retry_attempt")
+    try:
+        return int(raw or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def claim(message_id, retry=0):
+    """True the first time `message_id` is seen; False for a duplicate to drop."""
+    global _appends
+    with _lock:
+        now = time.time()
+        _expire(now)
+        if retry:
+            DEDUP_STATS["retries"] += 1
+        if message_id in _seen:
+            DEDUP_STATS["duplicates"] += 1
+            if retry:
+                DEDUP_STATS["duplicate_retries"] += 1
+                print(f"Dropping Slack retry #{retry} of {message_id}")
+            return False
+        _seen[message_id] = now
+        DEDUP_STATS["claimed"] += 1
+        try:
+            _log.write(f"{now}\t{message_id}\n")
+        except Exception as e:
+            print("Warning: could not save processed message:", e)
+        _appends += 1
+        if _appends >= max(DEDUP_COMPACT_MIN, len(_seen)):
+            _compact()
+        return True
+
+
+_load()
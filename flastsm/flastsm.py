@@ -5,10 +5,10 @@ import time
 from pathlib import Path
 from random import choice
 
-import requests
 from dotenv import load_dotenv
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
+from transport import http_session
 
 load_dotenv()
 
@@ -108,9 +108,8 @@ def handle_flastsm_setup(ack, respond, command, client):
 
 # --- Polling Loop ---
 def poll_lastfm():
-    from slack_sdk import WebClient
-
-    slack = WebClient(token=SLACK_TOKEN)
+    # same client as the bolt app, rather than a second one
+    slack = app.client
 
     while True:
         channels = load_channels()
@@ -119,7 +118,7 @@ def poll_lastfm():
                 lastfm_user = config["lastfm_user"]
                 slack_uid = config["slack_uid"]
 
-                response = requests.get(
+                response = http_session.get(
                     "http://ws.audioscrobbler.com/2.0/",
                     params={
                         "method": "user.getrecenttracks",
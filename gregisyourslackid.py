@@ -1,10 +1,11 @@
-import re
 from os import getenv
 
-import requests
+from dedup import claim, retry_num
 from dotenv import load_dotenv
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
+from transport import http_session
+from triggers import compile_router
 
 load_dotenv()
 
@@ -19,8 +20,6 @@ ADMINS = ["U091KE59H5H", "U091HG1TP6K"]
 
 app = App(token=SLACK_TOKEN)
 
-PROCESSED_MESSAGES = set()
-
 
 def get_slack_id_breakdown(user_id, slack_id):
     """Use AI to generate a greg-style sarcastic breakdown of every character in a Slack ID."""
@@ -59,7 +58,7 @@ def get_slack_id_breakdown(user_id, slack_id):
     - the breakdown must cover the ENTIRE slack id, do not skip any characters
     """
 
-    r = requests.post(
+    r = http_session.post(
         "https://ai.hackclub.com/proxy/v1/chat/completions",
         headers={
             "Authorization": f"Bearer {HACKCLUB_AI_KEY}",
@@ -83,28 +82,21 @@ def get_slack_id_breakdown(user_id, slack_id):
             return f"your slack id is `{slack_id}`. it is also greg. everything is greg."
 
 
-# trigger on "what is my slack id", "my slack id", "slack id", "whats my id" etc
-slack_id_pattern = re.compile(
-    r"(what('?s| is) my (slack )?id|my slack id|slack id|whats my id|who am i|what am i)",
-    re.IGNORECASE,
-)
+# trigger on "what is my slack id", "my slack id", "slack id", "whats my id" etc (see triggers.py)
+slack_id_pattern = compile_router("slack_id")
 
 
 @app.message(slack_id_pattern)
-def on_slack_id_request(ack, body, say):
+def on_slack_id_request(ack, body, say, request):
     ack()
 
     event = body["event"]
     channel = event["channel"]
     message_id = f"{channel}_{event['ts']}"
 
-    if message_id in PROCESSED_MESSAGES:
+    if not claim(message_id, retry_num(request.headers, body)):
         return
 
-    PROCESSED_MESSAGES.add(message_id)
-    if len(PROCESSED_MESSAGES) > 1000:
-        PROCESSED_MESSAGES.clear()
-
     user_id = event["user"]
     slack_id = user_id
 
@@ -1,10 +1,10 @@
-import re
 from os import getenv
 
-import requests
+from dedup import claim, retry_num
 from dotenv import load_dotenv
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
+from transport import http_session
 
 load_dotenv()
 
@@ -19,8 +19,6 @@ ADMINS = ["U091KE59H5H", "U091HG1TP6K"]
 
 app = App(token=SLACK_TOKEN)
 
-PROCESSED_MESSAGES = set()
-
 
 def get_slack_id_breakdown(user_id, slack_id):
     """Use AI to generate a greg-style sarcastic breakdown of every character in a Slack ID."""
@@ -59,7 +57,7 @@ def get_slack_id_breakdown(user_id, slack_id):
     - the breakdown must cover the ENTIRE slack id, do not skip any characters
     """
 
-    r = requests.post(
+    r = http_session.post(
         "https://ai.hackclub.com/proxy/v1/chat/completions",
         headers={
             "Authorization": f"Bearer {HACKCLUB_AI_KEY}",
@@ -84,7 +82,7 @@ def get_slack_id_breakdown(user_id, slack_id):
 
 
 @app.event("message")
-def on_any_message(event, say):
+def on_any_message(event, say, body, request):
     channel = event.get("channel")
     if channel not in ALLOWED_CHANNELS:
         return
@@ -96,17 +94,15 @@ def on_any_message(event, say):
         return
 
     text = event.get("text", "")
+    # every top-level message in the channel gets an answer, no trigger words
+    # needed; "##" opts a message out
     if text.startswith("##"):
         return
 
     message_id = f"{channel}_{event['ts']}"
-    if message_id in PROCESSED_MESSAGES:
+    if not claim(message_id, retry_num(request.headers, body)):
         return
 
-    PROCESSED_MESSAGES.add(message_id)
-    if len(PROCESSED_MESSAGES) > 1000:
-        PROCESSED_MESSAGES.clear()
-
     user_id = event.get("user")
     if not user_id:
         return
@@ -0,0 +1,274 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+# optional approximate nearest-neighbour index for the store
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# slavewithai's local fallback memory: a float32 matrix of L2-normalised
+# embeddings in a memory-mapped .npy file (grown by doubling) plus an
+# append-only side table of ids/texts where the latest line per row wins.
+# Once the store is big enough that brute force stops being cheap, an HNSW
+# index over the same rows (labels are row numbers) answers queries instead.
+# The index is saved every ANN_SAVE_EVERY writes and on close(), together with
+# how much of the side table it covers, so rows written or updated after the
+# last save are re-added on load even after a crash.
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+VECTORS_FILE = os.path.join(DATA_DIR, ".memory_store.npy")
+META_FILE = os.path.join(DATA_DIR, ".memory_store.meta.jsonl")
+LEGACY_FILE = os.path.join(DATA_DIR, ".memory_store.jsonl")
+ANN_FILE = os.path.join(DATA_DIR, ".memory_store.hnsw")
+INITIAL_ROWS = 1024
+ANN_MIN_ITEMS = 5000  # below this a single matrix-vector product is faster
+ANN_M = 16  # graph degree: more = better recall, more memory
+ANN_EF_CONSTRUCTION = 200
+ANN_EF_SEARCH = 64  # default for MEMORY_ANN_EF, the recall/latency knob
+ANN_SAVE_EVERY = 500  # writes between index saves
+
+_lock = threading.Lock()
+_loaded = False
+_vectors = None  # np.memmap of shape (capacity, dim)
+_count = 0
+_ids = []
+_texts = []
+_rows = {}  # id -> row
+_ann_index = None
+_ann_unsaved = 0
+
+
+def ann_enabled():
+    # read when used, not on import: slavewithai imports this before load_dotenv()
+    return hnswlib is not None and os.environ.get("MEMORY_ANN", "1") != "0"
+
+
+def _normalize(vector):
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+def _open(capacity, dim):
+    """Create (or grow into) a vectors file of `capacity` rows."""
+    global _vectors
+    tmp = VECTORS_FILE + ".tmp"
+    grown = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(capacity, dim))
+    if _vectors is not None:
+        grown[:_count] = _vectors[:_count]
+    grown.flush()
+    del grown
+    os.replace(tmp, VECTORS_FILE)
+    _vectors = np.lib.format.open_memmap(VECTORS_FILE, mode="r+")
+
+
+def _meta_size():
+    try:
+        return os.path.getsize(META_FILE)
+    except OSError:
+        return 0
+
+
+def _ann_build():
+    """Build the HNSW index from every row in the matrix."""
+    global _ann_index
+    index = hnswlib.Index(space="ip", dim=_vectors.shape[1])
+    index.init_index(max_elements=len(_vectors), ef_construction=ANN_EF_CONSTRUCTION, M=ANN_M)
+    index.add_items(_vectors[:_count], np.arange(_count))
+    _ann_index = index
+    _ann_save()
+
+
+def _ann_load(changed):
+    """Load the saved index and re-add the rows written since it was saved.
+
+    `changed` lists (side table offset, row) for every side table line; rows
+    written past the saved offset are the ones the index is missing or holds
+    an old vector for. An index that cannot be read, that holds more rows than
+    the side table (the store was truncated or replaced under it) or that has
+    no saved offset is rebuilt.
+    """
+    global _ann_index
+    if not os.path.exists(ANN_FILE):
+        if _count >= ANN_MIN_ITEMS:
+            _ann_build()
+        return
+    index = hnswlib.Index(space="ip", dim=_vectors.shape[1])
+    try:
+        with open(ANN_FILE + ".json", "r") as f:
+            offset = json.load(f)["meta_bytes"]
+        index.load_index(ANN_FILE, max_elements=len(_vectors))
+        indexed = index.get_current_count()
+    except Exception as e:
+        print("Warning: could not load memory index, rebuilding:", e)
+        _ann_build()
+        return
+    if indexed > _count:
+        print(f"Memory index has {indexed} rows but the store has {_count}, rebuilding")
+        _ann_build()
+        return
+    rows = {row for at, row in changed if at >= offset and row < _count}
+    rows = sorted(rows | set(range(indexed, _count)))
+    if rows:
+        index.add_items(_vectors[rows], np.array(rows))
+    _ann_index = index
+
+
+def _ann_save():
+    global _ann_unsaved
+    try:
+        # the offset is taken first: a row written meanwhile is re-added on load
+        offset = _meta_size()
+        _ann_index.save_index(ANN_FILE + ".tmp")
+        os.replace(ANN_FILE + ".tmp", ANN_FILE)
+        with open(ANN_FILE + ".json.tmp", "w") as f:
+            json.dump({"meta_bytes": offset}, f)
+        os.replace(ANN_FILE + ".json.tmp", ANN_FILE + ".json")
+    except Exception as e:
+        print("Warning: could not save memory index:", e)
+    _ann_unsaved = 0
+
+
+def _ann_add(row, vector):
+    """Insert or update one row in the index, building it once it pays off."""
+    global _ann_unsaved
+    if _ann_index is None:
+        if _count >= ANN_MIN_ITEMS:
+            _ann_build()
+        return
+    if _ann_index.get_max_elements() < len(_vectors):
+        _ann_index.resize_index(len(_vectors))
+    _ann_index.add_items(vector[None, :], np.array([row]))
+    _ann_unsaved += 1
+    if _ann_unsaved >= ANN_SAVE_EVERY:
+        _ann_save()
+
+
+def _load():
+    """Map the vectors file and read the side table (once per process)."""
+    global _vectors, _count, _loaded
+    _loaded = True
+    if os.path.exists(VECTORS_FILE):
+        _vectors = np.lib.format.open_memmap(VECTORS_FILE, mode="r+")
+        rows = {}
+        changed = []  # (side table offset, row) for every line
+        try:
+            with open(META_FILE, "rb") as f:
+                at = 0
+                for line in f:
+                    try:
+                        obj = json.loads(line)
+                        rows[obj["row"]] = (obj["id"], obj["text"])
+                        changed.append((at, obj["row"]))
+                    except Exception:
+                        pass
+                    at += len(line)
+        except FileNotFoundError:
+            pass
+        _count = min(len(rows), len(_vectors))
+        for row in range(_count):
+            item_id, text = rows.get(row, ("", ""))
+            _ids.append(item_id)
+            _texts.append(text)
+            _rows[item_id] = row
+        if ann_enabled():
+            _ann_load(changed)
+    elif os.path.exists(LEGACY_FILE):
+        # one-off import of the old jsonl store
+        with open(LEGACY_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    obj = json.loads(line)
+                    if obj.get("embedding"):
+                        _write(obj["id"], obj["embedding"], obj["text"])
+                except Exception:
+                    continue
+        os.replace(LEGACY_FILE, LEGACY_FILE + ".migrated")
+        print(f"Migrated {_count} memories to {VECTORS_FILE}")
+
+
+def _write(item_id, vector, text):
+    global _count
+    v = _normalize(vector)
+    if _vectors is None:
+        _open(INITIAL_ROWS, len(v))
+    elif len(v) != _vectors.shape[1]:
+        print(f"Warning: embedding dim {len(v)} != memory store dim {_vectors.shape[1]}")
+        return False
+    row = _rows.get(item_id)
+    if row is None:
+        row = _count
+        if row == len(_vectors):
+            _open(2 * row, len(v))
+        _ids.append(item_id)
+        _texts.append(text)
+        _rows[item_id] = row
+        _count += 1
+    else:
+        _texts[row] = text
+    _vectors[row] = v
+    _vectors.flush()
+    if ann_enabled():
+        _ann_add(row, v)
+    with open(META_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"row": row, "id": item_id, "text": text}) + "\n")
+    return True
+
+
+def upsert(item_id, vector, text):
+    """Store (or replace) one memory; False if it could not be written."""
+    try:
+        with _lock:
+            if not _loaded:
+                _load()
+            return _write(item_id, vector, text)
+    except Exception as e:
+        print("Warning: could not write memory store:", e)
+        return False
+
+
+def query(vector, top_k=3):
+    """Texts of the `top_k` memories most similar (cosine) to `vector`."""
+    try:
+        with _lock:
+            if not _loaded:
+                _load()
+            n = _count
+            if not n or top_k <= 0:
+                return []
+            k = min(top_k, n)
+            if _ann_index is not None:
+                ef = int(os.environ.get("MEMORY_ANN_EF", ANN_EF_SEARCH))
+                _ann_index.set_ef(max(ef, k))
+                labels, _ = _ann_index.knn_query(_normalize(vector), k=k)
+                return [_texts[i] for i in labels[0]]
+            # brute force: one matrix-vector product
+            scores = _vectors[:n] @ _normalize(vector)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [_texts[i] for i in top]
+    except Exception:
+        return []
+
+
+def close():
+    """Save the index if it has unsaved writes and forget the loaded store.
+
+    The next upsert or query loads it again.
+    """
+    global _vectors, _count, _loaded, _ann_index, _ann_unsaved
+    with _lock:
+        if _ann_index is not None and _ann_unsaved:
+            _ann_save()
+        _vectors = None
+        _count = 0
+        _ids.clear()
+        _texts.clear()
+        _rows.clear()
+        _ann_index = None
+        _ann_unsaved = 0
+        _loaded = False
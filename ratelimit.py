@@ -0,0 +1,63 @@
+import threading
+import time
+
+# One token bucket per Slack Web API method, refilled at the method's tier
+# limit (calls per minute) and shared by every thread in the process. A 429
+# blocks the method's bucket for its Retry-After.
+
+SLACK_TIER_LIMITS = {1: 1, 2: 20, 3: 50, 4: 100}
+SLACK_METHOD_TIERS = {
+    "auth_test": 4,
+    "chat_postMessage": 4,  # "special": roughly one per second per channel
+    "chat_update": 3,
+    "conversations_history": 3,
+    "conversations_list": 2,
+    "conversations_replies": 3,
+    "emoji_list": 2,
+    "reactions_add": 3,
+    "users_info": 4,
+    "users_conversations": 3,
+    "users_list": 2,
+}
+SLACK_BURST_SECONDS = 10  # a bucket holds this many seconds' worth of calls
+
+_buckets = {}  # method -> {"tokens", "updated", "blocked_until"}
+_lock = threading.Lock()
+
+
+def acquire(method, wait=True):
+    """Take a token for `method`, blocking until one is free.
+
+    With wait=False returns False straight away instead of blocking, so a
+    caller can skip a call it can make later.
+    """
+    per_minute = SLACK_TIER_LIMITS[SLACK_METHOD_TIERS.get(method, 3)]
+    rate = per_minute / 60
+    capacity = max(1, rate * SLACK_BURST_SECONDS)
+    while True:
+        with _lock:
+            now = time.monotonic()
+            b = _buckets.setdefault(
+                method, {"tokens": capacity, "updated": now, "blocked_until": 0}
+            )
+            if now < b["blocked_until"]:
+                delay = b["blocked_until"] - now
+            else:
+                b["tokens"] = min(capacity, b["tokens"] + (now - b["updated"]) * rate)
+                b["updated"] = now
+                if b["tokens"] >= 1 - 1e-9:  # refills are float, don't spin on rounding
+                    b["tokens"] = max(0, b["tokens"] - 1)
+                    return True
+                delay = (1 - b["tokens"]) / rate
+        if not wait:
+            return False
+        time.sleep(delay)
+
+
+def block(method, retry_after):
+    """Hold every call to `method` for `retry_after` seconds (after a 429)."""
+    with _lock:
+        now = time.monotonic()
+        b = _buckets.setdefault(method, {"tokens": 0, "updated": now, "blocked_until": 0})
+        b["blocked_until"] = max(b["blocked_until"], now + retry_after)
+        b["tokens"] = 0
@@ -0,0 +1,264 @@
+import json
+import os
+import threading
+import time
+
+# slavewithai's per-channel scan state, persisted across restarts:
+# `oldest` watermarks so each cycle only fetches new messages, the newest reply
+# seen in each watched thread, when each channel's threads were last swept,
+# when the bot last replied in each thread and each channel's poll schedule. Slack calls go through the `call` passed in,
+# so the rate limiting stays with the caller.
+
+SCAN_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".scan_state.json")
+HISTORY_PAGE_SIZE = 200
+THREAD_WATCH_SECONDS = 60 * 60 * 24  # keep checking a thread for replies for a day
+THREAD_WATCH_LIMIT = 200  # per channel, same as the old 200 message window
+# history from the watermark never brings a parent back once its thread moves,
+# so every THREAD_SWEEP_INTERVAL seconds a channel's recent parents are listed
+# again (one page, more only to reach the oldest watched parent, at most
+# THREAD_SWEEP_PAGES) and conversations.replies is only called for the threads
+# whose `latest_reply` moved
+THREAD_SWEEP_INTERVAL = 10  # the old poll interval
+THREAD_SWEEP_PAGES = 3
+
+STATE_KEYS = ("watermarks", "threads", "swept_at", "bot_replies", "schedule")
+
+state = {key: {} for key in STATE_KEYS}
+
+# scan workers update their own channel's entries; the lock keeps those updates
+# from racing the main loop's save
+lock = threading.RLock()
+
+
+def load(path=SCAN_STATE_FILE):
+    """Load saved state into `state` (in place, so references stay valid)."""
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except Exception:
+        data = {}
+    with lock:
+        for key in STATE_KEYS:
+            state[key] = data.get(key, {})
+    return state
+
+
+def save(path=SCAN_STATE_FILE):
+    try:
+        with lock:
+            data = json.dumps(state)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except Exception as e:
+        print("Warning: could not save scan state:", e)
+
+
+def fetch_channel_window(call, channel):
+    """Return the channel's messages newer than its watermark, oldest first.
+
+    Follows `has_more`/cursor pagination. A channel without a watermark gets a
+    single page of recent history, like the old fixed 200 message window.
+    Returns None on a Slack error.
+    """
+    oldest = state["watermarks"].get(channel)
+    messages = []
+    cursor = None
+    while True:
+        kwargs = {"channel": channel, "limit": HISTORY_PAGE_SIZE}
+        if oldest:
+            kwargs["oldest"] = oldest
+        if cursor:
+            kwargs["cursor"] = cursor
+        hist = call("conversations_history", **kwargs)
+        if not hist.get("ok"):
+            print("History error:", hist)
+            return None
+        messages.extend(hist.get("messages", []))
+        cursor = (hist.get("response_metadata") or {}).get("next_cursor")
+        if not oldest or not hist.get("has_more") or not cursor:
+            break
+    messages.sort(key=lambda m: float(m["ts"]))
+    if oldest:
+        # `oldest` is exclusive, but a message at exactly the watermark must
+        # never be handled twice
+        messages = [m for m in messages if float(m["ts"]) > float(oldest)]
+    return messages
+
+
+def advance_watermark(channel, messages):
+    """Move the channel's watermark to the newest message we have seen."""
+    if not messages:
+        return
+    newest = messages[-1]["ts"]
+    with lock:
+        current = state["watermarks"].get(channel)
+        if not current or float(newest) > float(current):
+            state["watermarks"][channel] = newest
+
+
+def seed_watermark(channel, now=None):
+    """Start a channel we have never scanned at `now` instead of its history."""
+    with lock:
+        state["watermarks"].setdefault(channel, f"{now or time.time():.6f}")
+
+
+def has_thread(msg):
+    """True for a parent with replies or a reply broadcast to the channel."""
+    return bool(msg.get("reply_count") or msg.get("latest_reply") or msg.get("thread_ts"))
+
+
+def watch_thread(channel, parent_ts, last_seen=None):
+    """Start watching a thread for replies (no-op if already watched).
+
+    `last_seen` is the newest reply already accounted for; without it the
+    first sweep fetches the whole thread.
+    """
+    with lock:
+        threads = state["threads"].setdefault(channel, {})
+        if parent_ts not in threads:
+            threads[parent_ts] = last_seen or parent_ts  # newest reply seen so far
+
+
+def is_watched(channel, parent_ts):
+    with lock:
+        return parent_ts in state["threads"].get(channel, {})
+
+
+def note_thread_reply(channel, parent_ts, reply_ts):
+    """Record a reply that arrived as an event so catch-up does not refetch it."""
+    with lock:
+        threads = state["threads"].setdefault(channel, {})
+        if float(reply_ts) > float(threads.get(parent_ts, parent_ts)):
+            threads[parent_ts] = reply_ts
+
+
+def prune_threads(channel, now=None):
+    """Forget watched threads (and their bot reply records) that have expired."""
+    cutoff = (now or time.time()) - THREAD_WATCH_SECONDS
+    with lock:
+        threads = state["threads"].get(channel, {})
+        bot_replies = state["bot_replies"].get(channel, {})
+        expired = [p for p in threads if float(p) < cutoff]
+        if len(threads) - len(expired) > THREAD_WATCH_LIMIT:
+            live = sorted((p for p in threads if float(p) >= cutoff), key=float)
+            expired.extend(live[: len(live) - THREAD_WATCH_LIMIT])
+        for parent_ts in expired:
+            del threads[parent_ts]
+        for parent_ts in [p for p in bot_replies if float(p) < cutoff]:
+            del bot_replies[parent_ts]
+
+
+def fetch_thread_parents(call, channel):
+    """Return the channel's recent messages, newest first, or None on an error.
+
+    One page, followed further back only until the oldest watched parent is
+    covered, and never more than THREAD_SWEEP_PAGES pages.
+    """
+    with lock:
+        watched = state["threads"].get(channel)
+        oldest = min(watched, key=float) if watched else None
+    messages = []
+    cursor = None
+    for _ in range(THREAD_SWEEP_PAGES):
+        kwargs = {"channel": channel, "limit": HISTORY_PAGE_SIZE}
+        if oldest:
+            kwargs.update(oldest=oldest, inclusive=True)
+        if cursor:
+            kwargs["cursor"] = cursor
+        hist = call("conversations_history", **kwargs)
+        if not hist.get("ok"):
+            print("History error:", hist)
+            return None
+        messages.extend(hist.get("messages", []))
+        cursor = (hist.get("response_metadata") or {}).get("next_cursor")
+        if not oldest or not hist.get("has_more") or not cursor:
+            break
+    return messages
+
+
+def threads_to_sweep(call, channel, now=None):
+    """Pick the threads with replies we have not seen yet, oldest parent first.
+
+    Returns nothing until THREAD_SWEEP_INTERVAL has passed since the channel's
+    last sweep. Then the recent parents are listed and a thread is due when its
+    `latest_reply` is past the newest reply seen there. A thread we are not
+    watching yet is due when it has a reply since the last sweep, and is
+    watched from then on, so a thread that starts after its parent was scanned
+    is still picked up. The first sweep of a channel only notes the time.
+    """
+    now = now or time.time()
+    with lock:
+        last_sweep = state["swept_at"].get(channel)
+        if last_sweep and now - last_sweep < THREAD_SWEEP_INTERVAL:
+            return []
+        state["swept_at"][channel] = now
+    parents = fetch_thread_parents(call, channel)
+    if parents is None:
+        return []
+    due = []
+    with lock:
+        threads = state["threads"].setdefault(channel, {})
+        for msg in parents:
+            parent_ts, latest = msg.get("ts"), msg.get("latest_reply")
+            if not parent_ts or not latest or msg.get("thread_ts", parent_ts) != parent_ts:
+                continue
+            if parent_ts not in threads:
+                if not last_sweep or float(latest) <= last_sweep:
+                    continue
+                threads[parent_ts] = max(parent_ts, f"{last_sweep:.6f}", key=float)
+            if float(latest) > float(threads[parent_ts]):
+                due.append(parent_ts)
+    return sorted(due, key=float)
+
+
+def sync_thread(call, channel, parent_ts, bot_user_id=None, advance=True):
+    """Fetch thread replies newer than the last one seen, oldest first.
+
+    The parent comes back first with its `latest_reply`; when that has not
+    moved past the last reply seen there is nothing new. Bot replies found
+    along the way are recorded so `already_replied` can be answered locally.
+    With `advance=False` only those bot replies are recorded and the thread's
+    last seen reply stays put, so the sweep still hands the replies out.
+    """
+    with lock:
+        threads = state["threads"].setdefault(channel, {})
+        last_seen = threads.get(parent_ts, parent_ts)
+    try:
+        resp = call(
+            "conversations_replies", channel=channel, ts=parent_ts, oldest=last_seen, limit=200
+        )
+        messages = resp.get("messages", []) if resp.get("ok") else []
+    except Exception:
+        return []
+    parent = next((m for m in messages if m.get("ts") == parent_ts), None)
+    if parent and float(parent.get("latest_reply") or parent_ts) <= float(last_seen):
+        return []
+    replies = [
+        r for r in messages if r.get("ts") and float(r["ts"]) > float(last_seen)
+    ]
+    replies.sort(key=lambda r: float(r["ts"]))
+    for r in replies:
+        if r.get("bot_id") or (bot_user_id and r.get("user") == bot_user_id):
+            record_bot_reply(channel, parent_ts, r["ts"])
+    if replies and advance:
+        with lock:
+            threads[parent_ts] = replies[-1]["ts"]
+    return replies
+
+
+def record_bot_reply(channel, thread_ts, reply_ts):
+    """Remember the newest bot reply in a thread."""
+    if not reply_ts:
+        return
+    with lock:
+        replies = state["bot_replies"].setdefault(channel, {})
+        if thread_ts not in replies or float(reply_ts) > float(replies[thread_ts]):
+            replies[thread_ts] = reply_ts
+
+
+def already_replied(channel, thread_ts, after_ts):
+    """True if the bot has replied in `thread_ts` at or after `after_ts`."""
+    last = state["bot_replies"].get(channel, {}).get(thread_ts)
+    return last is not None and float(last) >= float(after_ts)
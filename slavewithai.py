@@ -1,17 +1,48 @@
+import atexit
 import difflib
+import hashlib
 import json
 import os
+import queue
 import random
 import re
+import signal
+import sqlite3
+import sys
 import textwrap
+import threading
 import time
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
 
-import langfuse
-import requests
-from langfuse import get_client, observe
+import numpy as np
 from pinecone import Pinecone
+from slack_bolt import App
+from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+import memorystore
+import ratelimit
+import scanstate
+from scanstate import (
+    THREAD_WATCH_SECONDS,
+    advance_watermark,
+    already_replied,
+    fetch_channel_window,
+    has_thread,
+    is_watched,
+    note_thread_reply,
+    prune_threads,
+    record_bot_reply,
+    seed_watermark,
+    sync_thread,
+    threads_to_sweep,
+    watch_thread,
+)
+from tracing import observe
+from transport import http_session
+from triggers import compile_router
 
 # optionally load environment variables from a .env file if python-dotenv is installed
 try:
@@ -25,6 +56,11 @@ except Exception as e:
 SLACK_TOKEN = os.environ.get("SLACK_TOKEN")
 HACKCLUB_AI_KEY = os.environ.get("HACKCLUB_AI_KEY")
 PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
+# optional: with an app-level token (xapp-...) messages arrive over Socket Mode
+# and history is only polled to catch up after a (re)connect. Not APP_TOKEN:
+# that holds the other bots' app tokens in the shared .env, and a second
+# connection on their app would take a share of their events.
+APP_TOKEN = os.environ.get("SLAVEWITHAI_APP_TOKEN")
 
 if not SLACK_TOKEN or not HACKCLUB_AI_KEY or not PINECONE_API_KEY:
     print("Error: SLACK_TOKEN, HACKCLUB_AI_KEY and PINECONE_API_KEY must be set in the environment.")
@@ -34,31 +70,15 @@ if not SLACK_TOKEN or not HACKCLUB_AI_KEY or not PINECONE_API_KEY:
     print("See .env.example for the required variable names.")
     raise SystemExit(1)
 
-TRIGGERS = [  # these are converted to lower for case insensitivity :D
-    t.lower().strip()
-    for t in [
-        "assistant",
-        "slave",
-        "servant",
-        "unwanted ai",
-        "clanker",
-        "clanka",
-        "grok is this true",
-        "slack annoyance",
-        "U0A1K6RV4LC",
-        "@U0A1K6RV4LC",
-        "<@U0A1K6RV4LC>",
-        "@Slack Annoyance",
-        "greg",
-    ]
-]
+# all of greg's trigger phrases in one case-insensitive pattern (see triggers.py)
+TRIGGER_ROUTER = compile_router("greg")
 
-ALLOWED_CHANNELS = ["C09H93AKCLA", "C09H6322H7D", "C09KB5MT6N6", "C0A1TJJTT8U", "C09AHN6V1U7", "C0A21M6CWLU", "C0A1XK69529", "C09KUCDAXFE"]
+ALLOWED_CHANNELS = {"C09H93AKCLA", "C09H6322H7D", "C09KB5MT6N6", "C0A1TJJTT8U", "C09AHN6V1U7", "C0A21M6CWLU", "C0A1XK69529", "C09KUCDAXFE"}
 
 BANNED_USERS = ["<@UID>"]  # add banned users in the format <@UIDHERE>
 
 MODEL = "google/gemini-2.5-flash"
-POLL_INTERVAL = 10
+POLL_INTERVAL = 10  # starting interval for a channel we know nothing about
 
 # emoji reactions the bot may add when replying
 REACTIONS = [
@@ -96,137 +116,399 @@ REACTIONS = [
 
 slack = WebClient(token=SLACK_TOKEN)
 
+# --- SLACK RATE LIMITS ---
+# per-method token buckets (see ratelimit.py); 429s are retried after Retry-After
+SLACK_MAX_RETRIES = 3
+
+
+def slack_call(method, **kwargs):
+    """Call a WebClient method through its rate limit bucket, retrying 429s."""
+    for attempt in range(SLACK_MAX_RETRIES + 1):
+        ratelimit.acquire(method)
+        try:
+            return getattr(slack, method)(**kwargs)
+        except SlackApiError as e:
+            if e.response.status_code != 429 or attempt == SLACK_MAX_RETRIES:
+                raise
+            headers = e.response.headers or {}
+            retry_after = float(headers.get("Retry-After") or headers.get("retry-after") or 1)
+            ratelimit.block(method, retry_after)
+
 # initialize Pinecone client using API key from environment
 pc = Pinecone(api_key=PINECONE_API_KEY)
 
 # --- MEMORY (Pinecone + fallback) ---
 MEMORY_INDEX = os.environ.get("PINECONE_INDEX", "slack-annoyance-memory")
-FALLBACK_MEMORY_FILE = os.path.join(os.path.dirname(__file__), ".memory_store.jsonl")
+# local fallback when Pinecone is down: see memorystore.py
 
 
-def _embed_via_hackclub(text):
-    if not text:
-        return None
-    try:
-        r = requests.post(
-            "https://ai.hackclub.com/proxy/v1/embeddings",
-            headers={"Authorization": f"Bearer {HACKCLUB_AI_KEY}", "Content-Type": "application/json"},
-            json={"model": "text-embedding-3-small", "input": text},
-            timeout=10,
+# --- EMBEDDING CACHE ---
+# content-addressed: sha256 of (model, text). small in-memory LRU in front of a
+# sqlite table of float32 blobs that survives restarts; the memory writer prunes
+# the table back to the most recently used rows every few minutes
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+EMBEDDING_CACHE_FILE = os.path.join(os.path.dirname(__file__), ".embedding_cache.sqlite")
+EMBEDDING_CACHE_SIZE = 2048  # in-memory entries
+EMBEDDING_DISK_CACHE_SIZE = 50000  # rows kept on disk, ~6 KB each
+EMBEDDING_PRUNE_INTERVAL = 60 * 5  # seconds between prunes
+
+EMBEDDING_CACHE_STATS = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "pruned": 0}
+_embedding_lru = OrderedDict()
+_embedding_db = None
+_embedding_cache_lock = threading.Lock()
+
+
+def _embedding_key(text, model=EMBEDDING_MODEL):
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _embedding_cache_db():
+    global _embedding_db
+    if _embedding_db is None:
+        _embedding_db = sqlite3.connect(EMBEDDING_CACHE_FILE, check_same_thread=False)
+        _embedding_db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings"
+            " (key TEXT PRIMARY KEY, vector BLOB, last_used REAL NOT NULL DEFAULT 0)"
         )
-        r.raise_for_status()
-        j = r.json()
-        # robust extraction
         try:
-            return j["data"][0]["embedding"]
+            _embedding_db.execute(
+                "ALTER TABLE embeddings ADD COLUMN last_used REAL NOT NULL DEFAULT 0"
+            )
+        except sqlite3.OperationalError:
+            pass  # created with the column already
+        _embedding_db.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+    return _embedding_db
+
+
+def _lru_put(key, vector):
+    _embedding_lru[key] = vector
+    _embedding_lru.move_to_end(key)
+    if len(_embedding_lru) > EMBEDDING_CACHE_SIZE:
+        _embedding_lru.popitem(last=False)
+
+
+def get_cached_embedding(text, model=EMBEDDING_MODEL):
+    """Return the cached embedding for `text` or None (counts as a miss)."""
+    key = _embedding_key(text, model)
+    with _embedding_cache_lock:
+        vector = _embedding_lru.get(key)
+        if vector is not None:
+            _embedding_lru.move_to_end(key)
+            EMBEDDING_CACHE_STATS["memory_hits"] += 1
+            return vector
+        try:
+            row = _embedding_cache_db().execute(
+                "SELECT vector FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        except Exception as e:
+            print("Warning: embedding cache read failed:", e)
+            row = None
+        if row is None:
+            EMBEDDING_CACHE_STATS["misses"] += 1
+            return None
+        vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+        _lru_put(key, vector)
+        EMBEDDING_CACHE_STATS["disk_hits"] += 1
+        return vector
+
+
+def put_cached_embedding(text, vector, model=EMBEDDING_MODEL):
+    key = _embedding_key(text, model)
+    with _embedding_cache_lock:
+        _lru_put(key, vector)
+        try:
+            db = _embedding_cache_db()
+            db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                (key, np.asarray(vector, dtype=np.float32).tobytes(), time.time()),
+            )
+            db.commit()
+        except Exception as e:
+            print("Warning: embedding cache write failed:", e)
+
+
+def prune_embedding_cache():
+    """Keep only the EMBEDDING_DISK_CACHE_SIZE most recently used rows on disk.
+
+    Reads do not write, so the rows still in the in-memory LRU are marked used
+    here first.
+    """
+    with _embedding_cache_lock:
+        try:
+            db = _embedding_cache_db()
+            now = time.time()
+            db.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in _embedding_lru],
+            )
+            cur = db.execute(
+                "DELETE FROM embeddings WHERE rowid NOT IN"
+                " (SELECT rowid FROM embeddings ORDER BY last_used DESC LIMIT ?)",
+                (EMBEDDING_DISK_CACHE_SIZE,),
+            )
+            db.commit()
+            EMBEDDING_CACHE_STATS["pruned"] += max(cur.rowcount, 0)
+        except Exception as e:
+            print("Warning: embedding cache prune failed:", e)
+
+
+def embedding_cache_stats():
+    """Hit/miss counters plus the overall hit rate."""
+    stats = dict(EMBEDDING_CACHE_STATS)
+    lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+    stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+    return stats
+
+
+EMBEDDING_BATCH_SIZE = 64  # texts per /embeddings request
+
+
+def _embed_batch_via_hackclub(texts):
+    """Embed many texts with as few requests as possible.
+
+    Returns one vector (or None) per input text, in order. Cached texts are
+    served locally and the rest go out together in one `/embeddings` call.
+    """
+    out = [None] * len(texts)
+    missing = {}  # text -> positions
+    for i, text in enumerate(texts):
+        if not text:
+            continue
+        cached = get_cached_embedding(text)
+        if cached is not None:
+            out[i] = cached
+        else:
+            missing.setdefault(text, []).append(i)
+
+    pending = list(missing)
+    for start in range(0, len(pending), EMBEDDING_BATCH_SIZE):
+        chunk = pending[start : start + EMBEDDING_BATCH_SIZE]
+        try:
+            r = http_session.post(
+                "https://ai.hackclub.com/proxy/v1/embeddings",
+                headers={"Authorization": f"Bearer {HACKCLUB_AI_KEY}", "Content-Type": "application/json"},
+                json={"model": EMBEDDING_MODEL, "input": chunk},
+                timeout=10,
+            )
+            r.raise_for_status()
+            data = r.json().get("data", [])
         except Exception:
-            try:
-                return j["data"][0]["vector"]
-            except Exception:
-                return None
-    except Exception:
-        return None
+            continue
+        for pos, item in enumerate(data):
+            # robust extraction
+            emb = item.get("embedding") or item.get("vector")
+            text = chunk[item.get("index", pos)]
+            if not emb:
+                continue
+            put_cached_embedding(text, emb)
+            for i in missing[text]:
+                out[i] = emb
+    return out
 
 
-def _ensure_pinecone_index(index_name, dim):
-    try:
-        # attempt common client methods
-        if hasattr(pc, "create_index"):
-            try:
-                pc.create_index(name=index_name, dimension=dim)
-            except Exception:
-                pass
-        return _get_pinecone_index(index_name)
-    except Exception:
+def _embed_via_hackclub(text):
+    if not text:
         return None
+    return _embed_batch_via_hackclub([text])[0]
 
 
-def _get_pinecone_index(index_name):
-    # return an index-like object with `query` and `upsert` methods if available
-    try:
-        if hasattr(pc, "Index"):
-            return pc.Index(index_name)
-        if hasattr(pc, "index"):
-            return pc.index(index_name)
-        if hasattr(pc, "Client"):
-            client = pc.Client()
-            if hasattr(client, "Index"):
-                return client.Index(index_name)
-    except Exception:
+# the index handle is resolved once and reused (with its connection pool). if
+# Pinecone is unreachable or rejects a call, memory goes to the local store until
+# PINECONE_RETRY_SECONDS have passed
+PINECONE_POOL_THREADS = 4
+PINECONE_RETRY_SECONDS = 60
+
+_pinecone_index = None
+_pinecone_down_until = 0
+_pinecone_lock = threading.Lock()
+
+
+def _resolve_pinecone_index():
+    """Return an index handle for MEMORY_INDEX using whichever client API exists."""
+    if hasattr(pc, "has_index") and not pc.has_index(MEMORY_INDEX):
+        # try to create the index with the embedding model's dim
+        try:
+            pc.create_index(name=MEMORY_INDEX, dimension=EMBEDDING_DIM)
+        except Exception as e:
+            print(f"Warning: couldn't create Pinecone index {MEMORY_INDEX}: {e}")
+    if hasattr(pc, "Index"):
+        try:
+            return pc.Index(MEMORY_INDEX, pool_threads=PINECONE_POOL_THREADS)
+        except TypeError:
+            return pc.Index(MEMORY_INDEX)
+    if hasattr(pc, "index"):
+        return pc.index(MEMORY_INDEX)
+    return pc.Client().Index(MEMORY_INDEX)
+
+
+def _memory_index():
+    """Return the cached Pinecone index, or None while it is marked down."""
+    global _pinecone_index
+    if time.time() < _pinecone_down_until:
         return None
-    return None
+    if _pinecone_index is None:
+        with _pinecone_lock:
+            if _pinecone_index is None and time.time() >= _pinecone_down_until:
+                try:
+                    _pinecone_index = _resolve_pinecone_index()
+                except Exception as e:
+                    _pinecone_failed("resolve", e)
+    return _pinecone_index
 
 
-def _fallback_upsert(item_id, vector, text):
-    try:
-        with open(FALLBACK_MEMORY_FILE, "a", encoding="utf-8") as f:
-            obj = {"id": item_id, "text": text, "embedding": vector}
-            f.write(json.dumps(obj) + "\n")
-        return True
-    except Exception:
-        return False
+def _pinecone_failed(op, err):
+    """Use the local store for a while after a Pinecone failure."""
+    global _pinecone_down_until
+    _pinecone_down_until = time.time() + PINECONE_RETRY_SECONDS
+    print(f"Pinecone {op} failed, using local memory for {PINECONE_RETRY_SECONDS}s: {err}")
 
 
-def _fallback_query(vector, top_k=3):
-    """Compute cosine similarity against stored embeddings."""
-    if not os.path.exists(FALLBACK_MEMORY_FILE):
-        return []
-    
-    try:
-        items = []
-        with open(FALLBACK_MEMORY_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    obj = json.loads(line)
-                    if obj.get("embedding"):
-                        items.append(obj)
-                except Exception:
-                    continue
-
-        def _cos(a, b):
-            """Optimized cosine similarity."""
-            dot_product = sum(x * y for x, y in zip(a, b))
-            norm_a = sum(x * x for x in a) ** 0.5
-            norm_b = sum(x * x for x in b) ** 0.5
-            return dot_product / (norm_a * norm_b) if norm_a and norm_b else 0
-
-        scored = [((_cos(vector, item["embedding"]), item)) for item in items]
-        scored.sort(key=lambda x: x[0], reverse=True)
-        return [item["text"] for score, item in scored[:top_k]]
-    except Exception:
+PINECONE_UPSERT_BATCH = 100  # vectors per upsert request, well under Pinecone's limits
+
+
+def save_memories(items):
+    """Store many (item_id, text) pairs: one embedding request, batched upserts.
+
+    Anything Pinecone rejects goes to the local fallback store. Returns the
+    (item_id, text) pairs that were not stored anywhere, so callers can retry
+    just those; items without text are skipped, not failed.
+    """
+    items = [(item_id, text) for item_id, text in items if text]
+    if not items:
         return []
+    embs = _embed_batch_via_hackclub([text for _, text in items])
+    records = [(item_id, emb, text) for (item_id, text), emb in zip(items, embs) if emb]
+    failed = [(item_id, text) for (item_id, text), emb in zip(items, embs) if not emb]
+
+    for start in range(0, len(records), PINECONE_UPSERT_BATCH):
+        chunk = records[start : start + PINECONE_UPSERT_BATCH]
+        idx = _memory_index()
+        if idx:
+            try:
+                idx.upsert(
+                    vectors=[
+                        {"id": i, "values": v, "metadata": {"text": t}} for i, v, t in chunk
+                    ]
+                )
+                continue
+            except Exception as e:
+                _pinecone_failed("upsert", e)
+        for item_id, emb, text in chunk:
+            if not memorystore.upsert(item_id, emb, text):
+                failed.append((item_id, text))
+    return failed
 
 
 def save_memory(item_id, text):
     """Store text in Pinecone (or fallback file) with embedding."""
-    emb = _embed_via_hackclub(text)
-    if not emb:
-        return False
-    idx = _get_pinecone_index(MEMORY_INDEX)
-    if not idx:
-        # try to create index with guessed dim
-        idx = _ensure_pinecone_index(MEMORY_INDEX, dim=len(emb))
+    return bool(text) and not save_memories([(item_id, text)])
 
-    if idx:
+
+# --- MEMORY WRITER ---
+# replies are stored by a background thread so the poller can move on as soon as
+# it has posted. the queue is bounded: when it is full new items are dropped
+MEMORY_QUEUE_SIZE = 1000
+MEMORY_BATCH_SIZE = 32
+MEMORY_BATCH_WAIT = 0.5  # seconds to wait for more items before saving a batch
+MEMORY_MAX_RETRIES = 3
+MEMORY_SHUTDOWN_TIMEOUT = 10  # seconds to flush the queue on exit
+
+MEMORY_QUEUE_STATS = {"queued": 0, "saved": 0, "dropped": 0, "retries": 0, "failed": 0}
+_memory_queue = queue.Queue(maxsize=MEMORY_QUEUE_SIZE)
+_memory_writer = None
+
+
+def queue_memory(item_id, text):
+    """Hand a memory to the background writer (never blocks)."""
+    try:
+        _memory_queue.put_nowait((item_id, text))
+        MEMORY_QUEUE_STATS["queued"] += 1
+    except queue.Full:
+        MEMORY_QUEUE_STATS["dropped"] += 1
+
+
+def memory_queue_stats():
+    return {"depth": _memory_queue.qsize(), **MEMORY_QUEUE_STATS}
+
+
+def _save_with_retry(batch):
+    """Save a batch, retrying only the items that failed, with backoff."""
+    for attempt in range(MEMORY_MAX_RETRIES + 1):
         try:
-            # try common upsert signatures
-            if hasattr(idx, "upsert"):
-                try:
-                    idx.upsert([{"id": item_id, "values": emb, "metadata": {"text": text}}])
-                except Exception:
-                    try:
-                        idx.upsert([(item_id, emb, {"text": text})])
-                    except Exception:
-                        # try attribute-style
-                        idx.upsert(vectors=[(item_id, emb, {"text": text})])
-            else:
-                # unknown index object, fallback
-                return _fallback_upsert(item_id, emb, text)
-            return True
-        except Exception:
-            return _fallback_upsert(item_id, emb, text)
-    else:
-        return _fallback_upsert(item_id, emb, text)
+            failed = save_memories(batch)
+        except Exception as e:
+            print("Warning: could not save memories:", e)
+            failed = batch
+        MEMORY_QUEUE_STATS["saved"] += len(batch) - len(failed)
+        batch = failed
+        if not batch:
+            return
+        if attempt < MEMORY_MAX_RETRIES:
+            MEMORY_QUEUE_STATS["retries"] += 1
+            time.sleep(2**attempt)
+    MEMORY_QUEUE_STATS["failed"] += len(batch)
+
+
+def _memory_writer_loop():
+    """Drain the queue in batches until the `None` sentinel arrives.
+
+    Also prunes the embedding cache every EMBEDDING_PRUNE_INTERVAL, so the
+    prune never runs on a reply path.
+    """
+    stop = False
+    last_prune = 0
+    while not stop:
+        if time.time() - last_prune >= EMBEDDING_PRUNE_INTERVAL:
+            prune_embedding_cache()
+            last_prune = time.time()
+        try:
+            item = _memory_queue.get(timeout=EMBEDDING_PRUNE_INTERVAL)
+        except queue.Empty:
+            continue
+        if item is None:
+            break
+        batch = [item]
+        deadline = time.time() + MEMORY_BATCH_WAIT
+        while len(batch) < MEMORY_BATCH_SIZE:
+            try:
+                item = _memory_queue.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        _save_with_retry(batch)
+
+
+def start_memory_writer():
+    global _memory_writer
+    _memory_writer = threading.Thread(target=_memory_writer_loop, name="memory-writer", daemon=True)
+    _memory_writer.start()
+
+
+def shutdown_memory_writer():
+    """Flush whatever is queued, waiting at most MEMORY_SHUTDOWN_TIMEOUT."""
+    if not _memory_writer or not _memory_writer.is_alive():
+        return
+    try:
+        _memory_queue.put(None, timeout=MEMORY_SHUTDOWN_TIMEOUT)
+    except queue.Full:
+        pass
+    _memory_writer.join(MEMORY_SHUTDOWN_TIMEOUT)
+    stats = memory_queue_stats()
+    if stats["depth"]:
+        print(f"Warning: exiting with {stats['depth']} unsaved memories")
+    memorystore.close()
+
+
+start_memory_writer()
+atexit.register(shutdown_memory_writer)
+# turn SIGTERM (docker stop) into a normal exit so the queue gets flushed
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
 
 def retrieve_memories(query, top_k=3):
@@ -234,67 +516,124 @@ def retrieve_memories(query, top_k=3):
     emb = _embed_via_hackclub(query)
     if not emb:
         return []
-    idx = _get_pinecone_index(MEMORY_INDEX)
+    idx = _memory_index()
     if idx:
         try:
-            # try different query signatures
-            if hasattr(idx, "query"):
-                try:
-                    res = idx.query(vector=emb, top_k=top_k, include_metadata=True)
-                except Exception:
-                    res = idx.query(queries=[emb], top_k=top_k, include_metadata=True)
-
-                # extract matches
-                matches = []
-                if isinstance(res, dict):
-                    matches = res.get("matches") or res.get("results", [])
-                elif hasattr(res, "matches"):
-                    matches = getattr(res, "matches")
-
-                out = []
-                for m in matches:
-                    # metadata may be in different places
-                    md = m.get("metadata") if isinstance(m, dict) else getattr(m, "metadata", None)
-                    if md and md.get("text"):
-                        out.append(md.get("text"))
-                    else:
-                        # fallback to id or score
-                        txt = None
-                        if isinstance(m, dict):
-                            txt = m.get("id")
-                        else:
-                            txt = getattr(m, "id", None)
-                        if txt:
-                            out.append(str(txt))
-                return out[:top_k]
-        except Exception:
-            pass
-
-    return _fallback_query(emb, top_k=top_k)
-
-
-# persist handled message timestamps so restarts don't cause duplicate replies
-HANDLED_FILE = os.path.join(os.path.dirname(__file__), ".handled_ts.json")
+            res = idx.query(vector=emb, top_k=top_k, include_metadata=True)
+        except Exception as e:
+            _pinecone_failed("query", e)
+        else:
+            # extract matches
+            matches = res.get("matches", []) if isinstance(res, dict) else getattr(res, "matches", [])
+            out = []
+            for m in matches:
+                # metadata may be in different places
+                md = m.get("metadata") if isinstance(m, dict) else getattr(m, "metadata", None)
+                if md and md.get("text"):
+                    out.append(md.get("text"))
+                else:
+                    # fallback to id
+                    txt = m.get("id") if isinstance(m, dict) else getattr(m, "id", None)
+                    if txt:
+                        out.append(str(txt))
+            return out[:top_k]
+
+    return memorystore.query(emb, top_k=top_k)
+
+
+scan_state = scanstate.load()
+_scan_state_lock = scanstate.lock
+
+
+def post_reply(channel, text, thread_ts):
+    """Post into a thread, record the reply and watch the thread for follow-ups."""
+    resp = slack_call("chat_postMessage", channel=channel, text=text, thread_ts=thread_ts)
+    record_bot_reply(channel, thread_ts, resp.get("ts"))
+    if resp.get("ts"):
+        watch_thread(channel, thread_ts, resp["ts"])
+    return resp
+
+
+# persist handled message timestamps so restarts don't cause duplicate replies.
+# append-only log, compacted once it holds as many stale lines as live ones;
+# timestamps older than the scan window can never be seen again and expire
+HANDLED_FILE = os.path.join(os.path.dirname(__file__), ".handled_ts.log")
+LEGACY_HANDLED_FILE = os.path.join(os.path.dirname(__file__), ".handled_ts.json")
+HANDLED_TTL = THREAD_WATCH_SECONDS * 2
+HANDLED_COMPACT_MIN = 1000  # appends before the first compaction
+
+_handled_log = None
+_handled_appends = 0
+_handled_lock = threading.RLock()
+
+
+def _handled_expired(ts, now=None):
+    try:
+        return float(ts) < (now or time.time()) - HANDLED_TTL
+    except ValueError:
+        return True
 
 
 def load_handled():
+    """Load live handled timestamps from the log (or the old JSON file)."""
+    s = set()
     try:
         with open(HANDLED_FILE, "r") as f:
-            data = json.load(f)
-            return set(data)
-    except Exception:
-        return set()
+            s.update(line.strip() for line in f if line.strip())
+    except FileNotFoundError:
+        try:
+            with open(LEGACY_HANDLED_FILE, "r") as f:
+                s.update(json.load(f))
+        except Exception:
+            pass
+    except Exception as e:
+        print("Warning: could not load handled_ts:", e)
+    now = time.time()
+    return {ts for ts in s if not _handled_expired(ts, now)}
 
 
-def save_handled(s):
-    try:
-        with open(HANDLED_FILE, "w") as f:
-            json.dump(list(s), f)
-    except Exception as e:
-        print("Warning: could not save handled_ts:", e)
+def compact_handled():
+    """Drop expired timestamps and rewrite the log with only the live ones."""
+    global _handled_log, _handled_appends
+    now = time.time()
+    with _handled_lock:
+        for ts in [t for t in handled_ts if _handled_expired(t, now)]:
+            handled_ts.discard(ts)
+        try:
+            if _handled_log:
+                _handled_log.close()
+            tmp = HANDLED_FILE + ".tmp"
+            with open(tmp, "w") as f:
+                f.writelines(f"{ts}\n" for ts in handled_ts)
+            os.replace(tmp, HANDLED_FILE)
+            if os.path.exists(LEGACY_HANDLED_FILE):
+                os.remove(LEGACY_HANDLED_FILE)
+            _handled_log = open(HANDLED_FILE, "a", buffering=1)
+        except Exception as e:
+            _handled_log = None
+            print("Warning: could not compact handled_ts:", e)
+        _handled_appends = 0
+
+
+def mark_handled(ts):
+    """Record a handled message timestamp (O(1), one short append)."""
+    global _handled_appends
+    with _handled_lock:
+        if ts in handled_ts:
+            return
+        handled_ts.add(ts)
+        try:
+            _handled_log.write(f"{ts}\n")
+        except Exception as e:
+            print("Warning: could not save handled_ts:", e)
+        _handled_appends += 1
+        if _handled_appends >= max(HANDLED_COMPACT_MIN, len(handled_ts)):
+            compact_handled()
 
 
 handled_ts = load_handled()
+compact_handled()
+
 # identify bot user id to avoid replying to ourselves
 try:
     _auth = slack.auth_test()
@@ -307,6 +646,50 @@ except Exception:
     )
 
 
+# --- USER DIRECTORY ---
+# names for user ids, prewarmed from users.list in the background, each entry
+# expiring on its own. concurrent lookups of the same id share one users.info call
+USER_CACHE_TTL = 60 * 60 * 6
+USER_LOOKUP_TIMEOUT = 5  # seconds to wait for someone else's lookup of the same id
+USER_PREWARM_MAX_PAGES = 50  # users.list is Tier 2, don't spend ages on huge workspaces
+
+_user_cache = {}  # user id -> (name, expires_at)
+_user_cache_lock = threading.Lock()
+_user_inflight = {}  # user id -> threading.Event set when its lookup finishes
+
+
+def cache_user(user):
+    """Store the name from a users.info / users.list / user_change user object."""
+    profile = user.get("profile", {})
+    name = profile.get("display_name") or profile.get("real_name") or user.get("name")
+    if user.get("id") and name:
+        _user_cache[user["id"]] = (name, time.time() + USER_CACHE_TTL)
+
+
+def prewarm_user_cache():
+    """Page through users.list and cache every name."""
+    cursor = None
+    try:
+        for _ in range(USER_PREWARM_MAX_PAGES):
+            resp = slack_call("users_list", limit=200, cursor=cursor)
+            if not resp.get("ok"):
+                break
+            for user in resp.get("members", []):
+                cache_user(user)
+            cursor = (resp.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                break
+    except Exception as e:
+        print("Warning: couldn't prewarm user cache:", e)
+    print(f"Cached {len(_user_cache)} user names")
+
+
+def handle_user_change(event):
+    """Refresh a cached name from a `user_change` event."""
+    if event.get("user"):
+        cache_user(event["user"])
+
+
 def get_user_name(user_id):
     """Return a human-friendly name for a Slack user ID.
 
@@ -314,34 +697,69 @@ def get_user_name(user_id):
     """
     if not user_id:
         return ""
-    try:
-        resp = slack.users_info(user=user_id)
-        if resp.get("ok"):
-            u = resp.get("user", {})
-            profile = u.get("profile", {})
-            name = (
-                profile.get("display_name") or profile.get("real_name") or u.get("name")
-            )
-            if name:
-                return name
-    except Exception:
-        pass
-    return f"<@{user_id}>"
+    with _user_cache_lock:
+        hit = _user_cache.get(user_id)
+        if hit and hit[1] > time.time():
+            return hit[0]
+        done = _user_inflight.get(user_id)
+        owner = done is None
+        if owner:
+            done = _user_inflight[user_id] = threading.Event()
+    if not owner:
+        done.wait(USER_LOOKUP_TIMEOUT)
+    else:
+        try:
+            resp = slack_call("users_info", user=user_id)
+            if resp.get("ok"):
+                cache_user(resp.get("user", {}))
+        except Exception:
+            pass
+        finally:
+            with _user_cache_lock:
+                _user_inflight.pop(user_id, None)
+            done.set()
+    hit = _user_cache.get(user_id)
+    return hit[0] if hit else f"<@{user_id}>"
+
+
+threading.Thread(target=prewarm_user_cache, name="user-prewarm", daemon=True).start()
 
 # emoji cache for workspace emoji (refresh periodically)
 _emoji_cache = None
 _emoji_cache_time = 0
 _EMOJI_CACHE_TTL = 60 * 5  # refresh every 5 minutes
 
+# search index over `_emoji_cache`, rebuilt only when the cache is refreshed:
+# 2/3-gram postings so substring and fuzzy lookups only touch likely names
+_emoji_index = None
+EMOJI_FUZZY_CANDIDATES = 50  # best n-gram overlaps that get a full difflib ratio
+
+
+def _ngrams(s):
+    return {s[i : i + n] for n in (2, 3) for i in range(len(s) - n + 1)}
+
+
+def _build_emoji_index(names):
+    postings = {}
+    for name in names:
+        for gram in _ngrams(name):
+            postings.setdefault(gram, set()).add(name)
+    return {
+        "names": names,
+        "postings": postings,
+        # first of our preferred REACTIONS the workspace actually has
+        "fallback": next((r for r in REACTIONS if r in names), None),
+    }
+
 
 def load_emoji_list():
     """Load or return cached set of emoji short names available in the workspace."""
-    global _emoji_cache, _emoji_cache_time
+    global _emoji_cache, _emoji_cache_time, _emoji_index
     now = time.time()
     if _emoji_cache and now - _emoji_cache_time < _EMOJI_CACHE_TTL:
         return _emoji_cache
     try:
-        resp = slack.emoji_list()
+        resp = slack_call("emoji_list")
         if resp.get("ok"):
             em = resp.get("emoji", {})
             _emoji_cache = set(em.keys())
@@ -349,37 +767,71 @@ def load_emoji_list():
             _emoji_cache = set()
     except Exception:
         _emoji_cache = set()
+    _emoji_index = _build_emoji_index(_emoji_cache)
     _emoji_cache_time = now
     return _emoji_cache
 
 
+def emoji_substring_matches(index, k):
+    """All names containing `k`, checking only names that share its n-grams."""
+    if len(k) < 2:
+        return [e for e in index["names"] if k in e]
+    n = min(3, len(k))
+    grams = {k[i : i + n] for i in range(len(k) - n + 1)}
+    candidates = None
+    for gram in sorted(grams, key=lambda g: len(index["postings"].get(g, ()))):
+        posting = index["postings"].get(gram)
+        if not posting:
+            return []
+        candidates = set(posting) if candidates is None else candidates & posting
+        if not candidates:
+            return []
+    return [e for e in candidates if k in e]
+
+
+def emoji_fuzzy_matches(index, k, n=3, cutoff=0.7):
+    """Like difflib.get_close_matches, but only over names sharing n-grams with `k`."""
+    overlap = {}
+    for gram in _ngrams(k):
+        for name in index["postings"].get(gram, ()):
+            overlap[name] = overlap.get(name, 0) + 1
+    candidates = sorted(overlap, key=overlap.get, reverse=True)[:EMOJI_FUZZY_CANDIDATES]
+    return difflib.get_close_matches(k, candidates, n=n, cutoff=cutoff)
+
+
+# keyword -> reaction rules, one precompiled pattern per rule (first match wins)
+REACTION_RULES = [
+    (
+        re.compile("|".join(re.escape(k) for k in keywords)),
+        reactions,
+    )
+    for keywords, reactions in [
+        (("lol", "lmao", "haha", "rofl", "funny", "hilarious", "hehe"),
+            ["loll", "ultrafastparrot", "hehehe", "tradeoffer", "yay"]),
+        (("thanks", "thank", "nice", "great", "awesome", "love", "ty"),
+            ["yay", "star", "upvote", "wave-club-penguin"]),
+        (("sorry", "sad", "unfortunate", "rip", "tragic"),
+            ["heavysob", "3d-sad-emoji", "eyes-shaking"]),
+        (("what?", "wtf", "wait", "shocked", "wow", "really?", "no way", "whoa"),
+            ["shocked", "eyes-shaking", "dinowow"]),
+        (("stfu", "shut up", "no", "hate", "annoying", "angry", "wrong"),
+            ["angry-dino", "mad_ping_sock", "nooo", "get-out"]),
+        (("trade", "deal", "offer", "meme", "parrot"),
+            ["tradeoffer", "ultrafastparrot", "x"]),
+    ]
+]
+
+
 def choose_reaction_for_text(text, author_name=None):
     """Heuristic mapping from message text to preferred emoji short names."""
     if not text:
         return random.choice(REACTIONS)
-    
+
     t = text.lower()
-    
-    # keyword mapping for performance
-    reaction_map = {
-        ("lol", "lmao", "haha", "rofl", "funny", "hilarious", "hehe"): 
-            ["loll", "ultrafastparrot", "hehehe", "tradeoffer", "yay"],
-        ("thanks", "thank", "nice", "great", "awesome", "love", "ty"):
-            ["yay", "star", "upvote", "wave-club-penguin"],
-        ("sorry", "sad", "unfortunate", "rip", "tragic"):
-            ["heavysob", "3d-sad-emoji", "eyes-shaking"],
-        ("what?", "wtf", "wait", "shocked", "wow", "really?", "no way", "whoa"):
-            ["shocked", "eyes-shaking", "dinowow"],
-        ("stfu", "shut up", "no", "hate", "annoying", "angry", "wrong"):
-            ["angry-dino", "mad_ping_sock", "nooo", "get-out"],
-        ("trade", "deal", "offer", "meme", "parrot"):
-            ["tradeoffer", "ultrafastparrot", "x"]
-    }
-    
-    for keywords, reactions in reaction_map.items():
-        if any(k in t for k in keywords):
+    for pattern, reactions in REACTION_RULES:
+        if pattern.search(t):
             return random.choice(reactions)
-    
+
     return random.choice(REACTIONS)
 
 
@@ -387,7 +839,8 @@ def search_emoji_for_keywords(keywords, available):
     """Try to find a workspace emoji matching any of the provided keywords."""
     if not available:
         return None
-    
+    index = _emoji_index if _emoji_index and _emoji_index["names"] is available else _build_emoji_index(available)
+
     # normalize and dedupe keywords
     seen = set()
     normalized_kws = []
@@ -400,12 +853,12 @@ def search_emoji_for_keywords(keywords, available):
     # try substring then fuzzy matching
     for k in normalized_kws:
         # substring match
-        matches = [e for e in available if k in e]
+        matches = emoji_substring_matches(index, k)
         if matches:
             return random.choice(matches)
-        
+
         # fuzzy match
-        close = difflib.get_close_matches(k, list(available), n=3, cutoff=0.7)
+        close = emoji_fuzzy_matches(index, k)
         if close:
             return random.choice(close)
 
@@ -424,17 +877,8 @@ def add_reaction(channel, ts, text=None, author_name=None):
 
     chosen = choose_reaction_for_text(text or "", author_name=author_name)
 
-    # prefer emoji that actually exist in workspace; otherwise try fallbacks
-    if chosen not in available:
-        for alt in REACTIONS:
-            if alt in available:
-                chosen = alt
-                break
-    # if still not found and workspace has any emoji, take one
-    if chosen not in available and available:
-        chosen = next(iter(available))
-# I pull push doors
-    # if chosen isn't available, attempt to search workspace emoji by keywords
+    # prefer emoji that actually exist in workspace: search them by the
+    # message's keywords first, then fall back to our usual reactions
     if chosen not in available:
         keywords = []
         if author_name:
@@ -445,9 +889,15 @@ def add_reaction(channel, ts, text=None, author_name=None):
         found = search_emoji_for_keywords(keywords, available)
         if found:
             chosen = found
+    if chosen not in available and _emoji_index and _emoji_index["fallback"]:
+        chosen = _emoji_index["fallback"]
+    # if still not found and workspace has any emoji, take one
+    if chosen not in available and available:
+        chosen = next(iter(available))
+# I pull push doors
 
     try:
-        slack.reactions_add(channel=channel, name=chosen, timestamp=ts)
+        slack_call("reactions_add", channel=channel, name=chosen, timestamp=ts)
     except Exception:
         # ignore duplicate reaction or permission/rate errors
         return
@@ -455,7 +905,7 @@ def add_reaction(channel, ts, text=None, author_name=None):
 
 # --- AI CALL ---
 @observe
-def get_sarcastic_reply(message_text, author_name=None):
+def get_sarcastic_reply(message_text, author_name=None, mems=None):
     # build a single prompt string including the user's message
     # if author_name is provided, instruct the model to use the name naturally
     name_instruction = ""
@@ -463,11 +913,12 @@ def get_sarcastic_reply(message_text, author_name=None):
         # ask the model to include the user's name naturally inside the response
         name_instruction = f" Address the user by name: if possible, include the name '{author_name}' (DO NOT INCLUDE the @ sign) somewhere naturally inside the reply (do not just prepend \"{author_name}, \" to the message, and do not include it if it is not naturally fitting in)."
 
-    # include relevant past memories to provide context
-    try:
-        mems = retrieve_memories(message_text, top_k=3)
-    except Exception:
-        mems = []
+    # include relevant past memories to provide context (unless already fetched)
+    if mems is None:
+        try:
+            mems = retrieve_memories(message_text, top_k=3)
+        except Exception:
+            mems = []
 
     mem_block = ""
     if mems:
@@ -505,7 +956,7 @@ def get_sarcastic_reply(message_text, author_name=None):
             + f"user message: {message_text}"
         )
 
-    r = requests.post(
+    r = http_session.post(
         "https://ai.hackclub.com/proxy/v1/chat/completions",
         headers={
             "Authorization": f"Bearer {HACKCLUB_AI_KEY}",
@@ -534,6 +985,40 @@ def get_sarcastic_reply(message_text, author_name=None):
             return j.get("error", "Im broken inside lol :( Try again?")
 
 
+# --- REPLY PIPELINE ---
+# the name lookup and memory recall run side by side, each with a deadline
+# after which the reply goes ahead without it; the reaction only needs the name
+# so it runs alongside the LLM call
+NAME_STAGE_TIMEOUT = 3
+MEMORY_STAGE_TIMEOUT = 4
+reply_pool = ThreadPoolExecutor(max_workers=12, thread_name_prefix="reply")
+
+
+def _stage_result(future, timeout, fallback, stage):
+    try:
+        return future.result(timeout=timeout)
+    except FuturesTimeout:
+        print(f"Reply stage '{stage}' took over {timeout}s, replying without it")
+    except Exception as e:
+        print(f"Reply stage '{stage}' failed:", e)
+    return fallback
+
+
+def prepare_reply(channel, ts, user_id, text):
+    """Return (author_name, reply); reply is None if the author is banned."""
+    name_f = reply_pool.submit(get_user_name, user_id)
+    mems_f = reply_pool.submit(retrieve_memories, text, 3)
+
+    author_name = _stage_result(name_f, NAME_STAGE_TIMEOUT, f"<@{user_id}>", "name")
+    if author_name in BANNED_USERS:
+        return author_name, None
+    # add a reaction to the triggering message to show acknowledgement
+    reply_pool.submit(add_reaction, channel, ts, text=text, author_name=author_name)
+
+    mems = _stage_result(mems_f, MEMORY_STAGE_TIMEOUT, [], "memory")
+    return author_name, get_sarcastic_reply(text, author_name=author_name, mems=mems)
+
+
 # --- SPLIT LONG ---
 def split_response(text, max_len=300):
     parts = textwrap.wrap(text, max_len)
@@ -551,328 +1036,530 @@ def normalize_for_trigger(text):
     return text.strip().lower()
 
 
-# --- MAIN LOOP ---
-while True:
-    try:
-        # build channels to scan (include workspace channels); fallback to ALLOWED_CHANNELS
-        try:
-            # fetch public/private channels
-            ch_resp = slack.conversations_list(limit=200)
-            if ch_resp.get("ok"):
-                channels_to_scan = [c["id"] for c in ch_resp.get("channels", [])]
-            else:
-                channels_to_scan = ALLOWED_CHANNELS
-        except Exception:
-            channels_to_scan = ALLOWED_CHANNELS
+# --- STATS ---
+STATS_INTERVAL = 60 * 10  # seconds between stats lines in the log
+_last_stats = time.time()
 
-        # also fetch direct messages (ims) so the bot can respond to DMs
-        im_channels = []
-        try:
-            im_resp = slack.conversations_list(types="im", limit=200)
-            if im_resp.get("ok"):
-                im_channels = [c["id"] for c in im_resp.get("channels", [])]
-        except Exception:
-            im_channels = []
 
-        # combine all channel types
-        channels_to_scan = list(set(channels_to_scan) | set(ALLOWED_CHANNELS) | set(im_channels))
+def maybe_log_stats():
+    global _last_stats
+    if time.time() - _last_stats < STATS_INTERVAL:
+        return
+    _last_stats = time.time()
+    print("Embedding cache:", embedding_cache_stats())
+    print("Memory queue:", memory_queue_stats())
 
-        for channel in channels_to_scan:
-            hist = slack.conversations_history(channel=channel, limit=200)
 
-            if not hist.get("ok"):
-                print("History error:", hist)
-                continue
+# --- POLL SCHEDULE ---
+# every channel has its own interval: a trigger drops it to POLL_HOT_INTERVAL,
+# other activity to POLL_ACTIVE_INTERVAL, and each idle scan doubles it up to a
+# cap. DMs and allowed channels are capped at POLL_INTERVAL since that is where
+# people talk to the bot. The schedule lives in scan_state so restarts keep it.
+POLL_HOT_INTERVAL = 1
+POLL_ACTIVE_INTERVAL = 3
+POLL_BACKOFF = 2
+POLL_MAX_INTERVAL = 60 * 5
+# DMs and ALLOWED_CHANNELS never wait longer than the old fixed interval; that
+# is no more conversations.history calls for them than before, and the tier 3
+# budget it leaves is what the backed-off channels share
+POLL_MAX_INTERVAL_WATCHED = POLL_INTERVAL
+SCHEDULER_TICK = 0.25
 
-            messages = hist.get("messages", [])
 
-            for msg in reversed(messages):
-                ts = msg["ts"]
-                text = msg.get("text", "")
-                if not text or ts in handled_ts:
-                    continue
+def poll_cap(channel, is_im):
+    if is_im or channel in ALLOWED_CHANNELS:
+        return POLL_MAX_INTERVAL_WATCHED
+    return POLL_MAX_INTERVAL
 
-                # ignore bot messages and our own bot user id
-                if msg.get("user") == BOT_USER_ID and BOT_USER_ID:
-                    continue
 
-                normalized = normalize_for_trigger(text)
+def channel_due(channel, now):
+    entry = scan_state["schedule"].get(channel)
+    return not entry or entry["next"] <= now
 
-                # handle DM commands in IM channels (remember / recall)
-                try:
-                    if channel in im_channels:
-                        ltext = text.strip()
-                        # remember: <text>
-                        if ltext.lower().startswith("remember:"):
-                            to_store = ltext.split(":", 1)[1].strip()
-                            if to_store:
-                                sid = f"dm-{msg.get('user')}-{ts.replace('.', '-')}-remember"
-                                ok = save_memory(sid, to_store)
-                                try:
-                                    if ok:
-                                        slack.chat_postMessage(channel=channel, text="got it — saved to memory.")
-                                    else:
-                                        slack.chat_postMessage(channel=channel, text="couldn't save memory (fallback failed).")
-                                except Exception:
-                                    pass
-                                handled_ts.add(ts)
-                                save_handled(handled_ts)
-                                continue
-
-                        # recall <query>
-                        if ltext.lower().startswith("recall"):
-                            parts = ltext.split(None, 1)
-                            q = parts[1].strip() if len(parts) > 1 else ""
-                            if not q:
-                                try:
-                                    slack.chat_postMessage(channel=channel, text="usage: `recall <query>` — I'll fetch related memories.")
-                                except Exception:
-                                    pass
-                                handled_ts.add(ts)
-                                save_handled(handled_ts)
-                                continue
-                            try:
-                                mems = retrieve_memories(q, top_k=5)
-                                if mems:
-                                    body = "here are the top memories i found:\n" + "\n".join(f"- {m}" for m in mems)
-                                else:
-                                    body = "no related memories found."
-                                slack.chat_postMessage(channel=channel, text=body)
-                            except Exception:
-                                try:
-                                    slack.chat_postMessage(channel=channel, text="failed to retrieve memories.")
-                                except Exception:
-                                    pass
-                            handled_ts.add(ts)
-                            save_handled(handled_ts)
-                            continue
-                except Exception:
-                    pass
 
-                # decide where to post replies: use the parent thread if present
-                reply_target = msg.get("thread_ts") or ts
+def reschedule_channel(channel, is_im, activity):
+    """Set a channel's next poll from what its last scan found.
 
-                # allow triggers both on top-level messages and replies inside threads
-                triggered = any(
-                    normalized.startswith(t) or t in normalized for t in TRIGGERS
-                )
+    `activity` is "trigger", "messages" or None (idle).
+    """
+    with _scan_state_lock:
+        entry = scan_state["schedule"].get(channel) or {"interval": POLL_INTERVAL}
+        if activity == "trigger":
+            interval = POLL_HOT_INTERVAL
+        elif activity == "messages":
+            interval = min(entry["interval"], POLL_ACTIVE_INTERVAL)
+        else:
+            interval = entry["interval"] * POLL_BACKOFF
+        interval = max(POLL_HOT_INTERVAL, min(interval, poll_cap(channel, is_im)))
+        # a little jitter keeps channels that backed off together from lining up
+        next_due = time.time() + interval * random.uniform(0.9, 1.1)
+        scan_state["schedule"][channel] = {"interval": interval, "next": next_due}
+
+
+def prune_schedule(channels):
+    with _scan_state_lock:
+        for channel in [c for c in scan_state["schedule"] if c not in channels]:
+            del scan_state["schedule"][channel]
+
+
+# --- CHANNEL SCAN ---
+# the activity a message caused, least to most; the scheduler keys off the max
+ACTIVITY_RANK = {None: 0, "messages": 1, "trigger": 2}
+
+
+def more_active(a, b):
+    return a if ACTIVITY_RANK[a] >= ACTIVITY_RANK[b] else b
 
-                if triggered:
-                    # if triggered in a non-approved channel (and not a DM), ask user to move to the approved channel
-                    if (channel not in ALLOWED_CHANNELS) and (channel not in im_channels):
-                        try:
-                            slack.chat_postMessage(
-                                channel=channel,
-                                text="You gotta be in <#C0A1TJJTT8U> to talk to me ay",
-                                thread_ts=reply_target,
-                            )
-                        except Exception:
-                            pass
-
-                        handled_ts.add(ts)
-                        save_handled(handled_ts)
-                        continue
-                    # Before replying, check whether we've already replied in this thread
+
+def handle_message(channel, msg, is_im):
+    """Handle a top-level (or broadcast) message; returns "trigger" or None."""
+    activity = None
+    ts = msg["ts"]
+    text = msg.get("text", "")
+
+    # watch threads that already have replies (or were broadcast from); a
+    # thread that starts later is picked up by the sweep
+    if has_thread(msg):
+        watch_thread(channel, msg.get("thread_ts") or ts)
+
+    if not text or ts in handled_ts:
+        return activity
+
+    # ignore bot messages and our own bot user id
+    if msg.get("user") == BOT_USER_ID and BOT_USER_ID:
+        return activity
+
+    normalized = normalize_for_trigger(text)
+
+    # handle DM commands in IM channels (remember / recall)
+    try:
+        if is_im:
+            activity = "trigger"  # any DM is someone talking to the bot
+            ltext = text.strip()
+            # remember: <text>
+            if ltext.lower().startswith("remember:"):
+                to_store = ltext.split(":", 1)[1].strip()
+                if to_store:
+                    sid = f"dm-{msg.get('user')}-{ts.replace('.', '-')}-remember"
+                    ok = save_memory(sid, to_store)
                     try:
-                        replies_resp = slack.conversations_replies(
-                            channel=channel, ts=reply_target, limit=200
-                        )
-                        if replies_resp.get("ok"):
-                            replies = replies_resp.get("messages", [])
+                        if ok:
+                            slack_call("chat_postMessage", channel=channel, text="got it — saved to memory.")
                         else:
-                            replies = []
+                            slack_call("chat_postMessage", channel=channel, text="couldn't save memory (fallback failed).")
                     except Exception:
-                        replies = []
-
-                    already_replied = False
-                    if replies:
-                        # if we know our bot user id, check for a reply from it
-                        if BOT_USER_ID:
-                            for r in replies:
-                                if r.get("user") == BOT_USER_ID or r.get("bot_id"):
-                                    # only consider replies that came after this message
-                                    try:
-                                        if float(r.get("ts", "0")) >= float(ts):
-                                            already_replied = True
-                                            break
-                                    except Exception:
-                                        already_replied = True
-                                        break
-                        else:
-                            # fallback: if any bot-like message exists in replies, consider it answered
-                            for r in replies:
-                                if r.get("bot_id"):
-                                    already_replied = True
-                                    break
-
-                    if already_replied:
-                        handled_ts.add(ts)
-                        save_handled(handled_ts)
-                        continue
-
-                    # personalize by including the user's name inside the response
-                    author_name = get_user_name(msg.get("user"))
-                    if author_name not in BANNED_USERS:
-                        reply = get_sarcastic_reply(text, author_name=author_name)
-                        parts = split_response(reply)
-                        langfuse = get_client()
-                        langfuse.flush()
-
-                        for p in parts:
-                            try:
-                                slack.chat_postMessage(
-                                    channel=channel,
-                                    text=p,
-                                    thread_ts=reply_target,
-                                )
-                            except Exception as e:
-                                print(f"Post error (channel={channel} ts={ts}): {e}")
-                        # add a reaction to the triggering message to show acknowledgement
-                        try:
-                            add_reaction(channel, ts, text=text, author_name=author_name)
-                        except Exception:
-                            pass
-                        # store message+reply in memory (best-effort)
-                        try:
-                            mem_id = f"msg-{ts.replace('.', '-') }"
-                            save_memory(mem_id + "-user", text)
-                            save_memory(mem_id + "-reply", reply)
-                        except Exception:
-                            pass
-                        handled_ts.add(ts)
-                        save_handled(handled_ts)
-                    else:
-                        slack.chat_postMessage(
-                            channel=channel,
-                            text="You are banned. Please message an owner if you think this is a mistake.",
-                            thread_ts=reply_target,
-                        )
-
-                # Additionally, inspect replies inside this thread (if any)
-                # so the bot will respond to triggers that appear only in thread replies.
-                # Always check for thread replies, don't rely on reply_count
+                        pass
+                    mark_handled(ts)
+                    return activity
+
+            # recall <query>
+            if ltext.lower().startswith("recall"):
+                parts = ltext.split(None, 1)
+                q = parts[1].strip() if len(parts) > 1 else ""
+                if not q:
+                    try:
+                        slack_call("chat_postMessage", channel=channel, text="usage: `recall <query>` — I'll fetch related memories.")
+                    except Exception:
+                        pass
+                    mark_handled(ts)
+                    return activity
                 try:
-                    thread_resp = slack.conversations_replies(
-                        channel=channel, ts=ts, limit=200
-                    )
-                    if thread_resp.get("ok"):
-                        thread_msgs = thread_resp.get("messages", [])
+                    mems = retrieve_memories(q, top_k=5)
+                    if mems:
+                        body = "here are the top memories i found:\n" + "\n".join(f"- {m}" for m in mems)
                     else:
-                        thread_msgs = []
+                        body = "no related memories found."
+                    slack_call("chat_postMessage", channel=channel, text=body)
                 except Exception:
-                    thread_msgs = []
-
-                # iterate over replies (skip the parent which is the first item)
-                for reply_msg in thread_msgs:
-                    rts = reply_msg.get("ts")
-                    if not rts or rts == ts or rts in handled_ts:
-                        continue
-
-                    # ignore bot messages and our own bot user id
-                    if reply_msg.get("bot_id") or (
-                        BOT_USER_ID and reply_msg.get("user") == BOT_USER_ID
-                    ):
-                        handled_ts.add(rts)
-                        continue
-
-                    rtext = reply_msg.get("text", "")
-                    rnormalized = normalize_for_trigger(rtext)
-
-                    triggered_in_reply = any(
-                        rnormalized.startswith(t) or t in rnormalized
-                        for t in TRIGGERS
-                    )
-
-                    if not triggered_in_reply:
-                        continue
-
-                    # check if we've already replied in this thread after this reply
-                    already_replied = False
                     try:
-                        replies_resp = slack.conversations_replies(
-                            channel=channel, ts=ts, limit=200
-                        )
-                        if replies_resp.get("ok"):
-                            replies = replies_resp.get("messages", [])
-                        else:
-                            replies = []
+                        slack_call("chat_postMessage", channel=channel, text="failed to retrieve memories.")
                     except Exception:
-                        replies = []
-
-                    if replies:
-                        if BOT_USER_ID:
-                            for r in replies:
-                                if r.get("user") == BOT_USER_ID or r.get("bot_id"):
-                                    try:
-                                        if float(r.get("ts", "0")) >= float(rts):
-                                            already_replied = True
-                                            break
-                                    except Exception:
-                                        already_replied = True
-                                        break
-                        else:
-                            for r in replies:
-                                if r.get("bot_id"):
-                                    already_replied = True
-                                    break
-
-                    if already_replied:
-                        handled_ts.add(rts)
-                        save_handled(handled_ts)
-                        continue
-
-                    # check if thread reply is in an allowed channel
-                    if (channel not in ALLOWED_CHANNELS) and (channel not in im_channels):
-                        try:
-                            slack.chat_postMessage(
-                                channel=channel,
-                                text="You gotta be in <#C0A1TJJTT8U> to talk to me ay",
-                                thread_ts=ts,
-                            )
-                        except Exception:
-                            pass
-                        handled_ts.add(rts)
-                        save_handled(handled_ts)
-                        continue
-
-                    # post reply into the parent thread and include the replier's name
-                    replier_name = get_user_name(reply_msg.get("user"))
-                    if replier_name not in BANNED_USERS:
-                        reply = get_sarcastic_reply(rtext, author_name=replier_name)
-                        parts = split_response(reply)
-                        for p in parts:
-                            try:
-                                slack.chat_postMessage(
-                                    channel=channel,
-                                    text=p,
-                                    thread_ts=ts,
-                                )
-                            except Exception as e:
-                                print(f"Post error (channel={channel} ts={rts}): {e}")
-                        # add a reaction to the triggering reply message
-                        try:
-                            add_reaction(channel, rts, text=rtext, author_name=replier_name)
-                        except Exception:
-                            pass
-                        # store reply+original in memory (best-effort)
-                        try:
-                            mem_id = f"msg-{rts.replace('.', '-') }"
-                            save_memory(mem_id + "-user", rtext)
-                            save_memory(mem_id + "-reply", reply)
-                        except Exception:
-                            pass
-                        handled_ts.add(rts)
-                        save_handled(handled_ts)
-                    else:
-                        slack.chat_postMessage(
-                            channel=channel,
-                            text="You are banned. Please message an owner if you think this is a mistake.",
-                            thread_ts=ts,
-                        )
-                        handled_ts.add(rts)
-                        save_handled(handled_ts)
+                        pass
+                mark_handled(ts)
+                return activity
+    except Exception:
+        pass
+
+    # decide where to post replies: use the parent thread if present
+    reply_target = msg.get("thread_ts") or ts
+
+    # allow triggers both on top-level messages and replies inside threads
+    triggered = TRIGGER_ROUTER.search(normalized) is not None
+
+    if triggered:
+        activity = "trigger"
+        # if triggered in a non-approved channel (and not a DM), ask user to move to the approved channel
+        if channel not in ALLOWED_CHANNELS and not is_im:
+            try:
+                post_reply(
+                    channel,
+                    "You gotta be in <#C0A1TJJTT8U> to talk to me ay",
+                    reply_target,
+                )
+            except Exception:
+                pass
+
+            mark_handled(ts)
+            return activity
+        # Before replying, check whether we've already replied in this thread.
+        # Only a thread with replies we have not scanned yet costs a fetch, and
+        # it leaves those replies for the thread sweep to handle.
+        last_seen = scan_state["threads"].get(channel, {}).get(reply_target, reply_target)
+        if float(msg.get("latest_reply") or ts) > float(last_seen):
+            sync_thread(slack_call, channel, reply_target, BOT_USER_ID, advance=False)
+
+        if already_replied(channel, reply_target, ts):
+            mark_handled(ts)
+            return activity
+
+        # personalize by including the user's name inside the response
+        author_name, reply = prepare_reply(channel, ts, msg.get("user"), text)
+        if reply is not None:
+            parts = split_response(reply)
+            for p in parts:
+                try:
+                    post_reply(channel, p, reply_target)
+                except Exception as e:
+                    print(f"Post error (channel={channel} ts={ts}): {e}")
+            # store message+reply in memory (best-effort, in the background)
+            mem_id = f"msg-{ts.replace('.', '-') }"
+            queue_memory(mem_id + "-user", text)
+            queue_memory(mem_id + "-reply", reply)
+            mark_handled(ts)
+        else:
+            post_reply(
+                channel,
+                "You are banned. Please message an owner if you think this is a mistake.",
+                reply_target,
+            )
+    return activity
+
+
+def handle_thread_reply(channel, ts, reply_msg, is_im):
+    """Handle a reply in the thread `ts`; returns "trigger", "messages" or None."""
+    activity = None
+    rts = reply_msg["ts"]
+    if rts == ts or rts in handled_ts:
+        return activity
+
+    # ignore bot messages and our own bot user id
+    if reply_msg.get("bot_id") or (
+        BOT_USER_ID and reply_msg.get("user") == BOT_USER_ID
+    ):
+        return activity
+
+    rtext = reply_msg.get("text", "")
+    rnormalized = normalize_for_trigger(rtext)
+
+    triggered_in_reply = TRIGGER_ROUTER.search(rnormalized) is not None
+
+    if not triggered_in_reply:
+        return "messages"
+    activity = "trigger"
+
+    # check if we've already replied in this thread after this reply
+    if already_replied(channel, ts, rts):
+        mark_handled(rts)
+        return activity
+
+    # check if thread reply is in an allowed channel
+    if channel not in ALLOWED_CHANNELS and not is_im:
+        try:
+            post_reply(
+                channel,
+                "You gotta be in <#C0A1TJJTT8U> to talk to me ay",
+                ts,
+            )
+        except Exception:
+            pass
+        mark_handled(rts)
+        return activity
+
+    # post reply into the parent thread and include the replier's name
+    replier_name, reply = prepare_reply(channel, rts, reply_msg.get("user"), rtext)
+    if reply is not None:
+        parts = split_response(reply)
+        for p in parts:
+            try:
+                post_reply(channel, p, ts)
+            except Exception as e:
+                print(f"Post error (channel={channel} ts={rts}): {e}")
+        # store reply+original in memory (best-effort, in the background)
+        mem_id = f"msg-{rts.replace('.', '-') }"
+        queue_memory(mem_id + "-user", rtext)
+        queue_memory(mem_id + "-reply", reply)
+        mark_handled(rts)
+    else:
+        post_reply(
+            channel,
+            "You are banned. Please message an owner if you think this is a mistake.",
+            ts,
+        )
+        mark_handled(rts)
+    return activity
+
+
+def scan_channel(channel, is_im):
+    """Handle new messages, then the threads that have new replies, in order.
+
+    Returns "trigger", "messages" or None so the scheduler can adapt.
+    """
+    messages = fetch_channel_window(slack_call, channel)
+    if messages is None:
+        return None
+    activity = "messages" if messages else None
+
+    for msg in messages:
+        activity = more_active(activity, handle_message(channel, msg, is_im))
+
+    advance_watermark(channel, messages)
 
+    # inspect replies in threads whose latest_reply moved so the bot will
+    # respond to triggers that appear only in thread replies
+    for ts in threads_to_sweep(slack_call, channel):
+        for reply_msg in sync_thread(slack_call, channel, ts, BOT_USER_ID):
+            activity = more_active(activity, handle_thread_reply(channel, ts, reply_msg, is_im))
+
+    prune_threads(channel)
+    return activity
+
+
+# scans and events for the same channel take its lock so replies stay in order
+_channel_locks = {}
+_channel_locks_lock = threading.Lock()
+
+
+def channel_lock(channel):
+    with _channel_locks_lock:
+        lock = _channel_locks.get(channel)
+        if lock is None:
+            lock = _channel_locks[channel] = threading.Lock()
+        return lock
+
+
+def _scan_channel_safely(channel, is_im):
+    activity = None
+    try:
+        with channel_lock(channel):
+            activity = scan_channel(channel, is_im)
     except Exception as e:
-        print("Loop error:", e)
+        print(f"Scan error (channel={channel}):", e)
+    reschedule_channel(channel, is_im, activity)
+
+
+# channels are scanned on a bounded pool; Slack calls are throttled per method
+SCAN_WORKERS = 4
+scan_pool = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="scan")
+_scans = {}  # channel -> Future of its current scan
+
+
+def submit_scan(channel, is_im):
+    # one scan per channel at a time keeps its replies in order
+    running = _scans.get(channel)
+    if running and not running.done():
+        return
+    _scans[channel] = scan_pool.submit(_scan_channel_safely, channel, is_im)
+
+
+# --- CHANNEL DIRECTORY ---
+# every channel (public or private) the bot is a member of and every DM it has,
+# listed with users.conversations (only the bot's own conversations, unlike
+# conversations.list) with full cursor pagination and cached; in Socket Mode channel/IM
+# events keep it current between refreshes. A channel that shows up without a
+# watermark is scanned from when it was found, not from its last 200 messages.
+CHANNEL_DIRECTORY_TTL = 60 * 10
+CHANNEL_DIRECTORY_RETRY = 60  # after a failed refresh
+CHANNEL_LIST_PAGE_SIZE = 1000  # Slack's maximum for users.conversations
+
+_directory_lock = threading.Lock()
+_directory = {"channels": set(), "ims": set(), "expires": 0}
+
+
+def refresh_channel_directory(force=False):
+    """Relist channels and DMs if the cached directory has expired."""
+    with _directory_lock:
+        if not force and _directory["expires"] > time.time():
+            return
+    channels, ims = set(), set()
+    cursor = None
+    try:
+        while True:
+            resp = slack_call(
+                "users_conversations",
+                types="public_channel,private_channel,im",
+                exclude_archived=True,
+                limit=CHANNEL_LIST_PAGE_SIZE,
+                cursor=cursor,
+            )
+            for c in resp.get("channels", []):
+                (ims if c.get("is_im") else channels).add(c["id"])
+            cursor = (resp.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                break
+    except Exception as e:
+        print("Warning: could not list channels:", e)
+        with _directory_lock:
+            _directory["expires"] = time.time() + CHANNEL_DIRECTORY_RETRY
+        return
+    for channel in (channels | ims) - ALLOWED_CHANNELS:
+        seed_watermark(channel)
+    with _directory_lock:
+        _directory.update(channels=channels, ims=ims, expires=time.time() + CHANNEL_DIRECTORY_TTL)
+    prune_schedule(channels | ims | ALLOWED_CHANNELS)
+
+
+def directory_add(channel, is_im=False):
+    if channel not in ALLOWED_CHANNELS:
+        seed_watermark(channel)
+    with _directory_lock:
+        _directory["ims" if is_im else "channels"].add(channel)
+
+
+def directory_remove(channel):
+    with _directory_lock:
+        _directory["channels"].discard(channel)
+        _directory["ims"].discard(channel)
+
+
+def list_channels():
+    """Return (channels_to_scan, im_channels); ALLOWED_CHANNELS are always scanned."""
+    refresh_channel_directory()
+    with _directory_lock:
+        ims = set(_directory["ims"])
+        return list(_directory["channels"] | ims | ALLOWED_CHANNELS), ims
+
+
+# --- SOCKET MODE ---
+# message subtypes that carry something a person typed
+EVENT_SUBTYPES = (None, "file_share", "thread_broadcast")
+
+
+def handle_event_message(event):
+    """Run a pushed message through the same handlers the history scan uses."""
+    if event.get("subtype") not in EVENT_SUBTYPES:
+        return
+    channel = event.get("channel")
+    ts = event.get("ts")
+    if not channel or not ts:
+        return
+    is_im = event.get("channel_type") == "im"
+    thread_ts = event.get("thread_ts")
+
+    with channel_lock(channel):
+        if thread_ts and thread_ts != ts and event.get("subtype") != "thread_broadcast":
+            # first reply we see in an unwatched thread: fetch it once so bot
+            # replies that were already there count for `already_replied`
+            if not is_watched(channel, thread_ts):
+                sync_thread(slack_call, channel, thread_ts, BOT_USER_ID)
+            handle_thread_reply(channel, thread_ts, event, is_im)
+            note_thread_reply(channel, thread_ts, ts)
+        else:
+            handle_message(channel, event, is_im)
+            advance_watermark(channel, [event])
+
+
+def catch_up():
+    """Scan every channel from its watermark, for whatever a disconnect missed."""
+    channels, ims = list_channels()
+    for channel in channels:
+        submit_scan(channel, channel in ims)
+
+
+def on_socket_message(client, message, raw_message):
+    # Slack sends `hello` on every (re)connect
+    if message.get("type") == "hello":
+        print("Socket Mode connected, catching up on missed messages")
+        threading.Thread(target=catch_up, daemon=True).start()
+
+
+def run_socket_mode():
+    app = App(token=SLACK_TOKEN, client=slack)
+
+    @app.event("message")
+    def on_message(event):
+        try:
+            handle_event_message(event)
+        except Exception as e:
+            print(f"Event error (channel={event.get('channel')} ts={event.get('ts')}):", e)
+
+    @app.event("user_change")
+    def on_user_change(event):
+        handle_user_change(event)
+
+    @app.event("im_created")
+    def on_im_created(event):
+        directory_add(event["channel"]["id"], is_im=True)
+
+    @app.event("member_joined_channel")
+    def on_member_joined_channel(event):
+        if event.get("user") == BOT_USER_ID:
+            directory_add(event["channel"])
+
+    @app.event("channel_archive")
+    def on_channel_archive(event):
+        directory_remove(event["channel"])
+
+    @app.event("channel_deleted")
+    def on_channel_deleted(event):
+        directory_remove(event["channel"])
+
+    @app.event("group_archive")
+    def on_group_archive(event):
+        directory_remove(event["channel"])
+
+    @app.event("group_deleted")
+    def on_group_deleted(event):
+        directory_remove(event["channel"])
+
+    @app.event("channel_left")
+    def on_channel_left(event):
+        directory_remove(event["channel"])
+
+    @app.event("group_left")
+    def on_group_left(event):
+        directory_remove(event["channel"])
+
+    handler = SocketModeHandler(app, APP_TOKEN)
+    handler.client.message_listeners.append(on_socket_message)
+    handler.connect()
+
+    while True:
+        time.sleep(POLL_INTERVAL)
+        # without scans nothing else expires watched threads
+        with _scan_state_lock:
+            channels = list(scan_state["threads"])
+        for channel in channels:
+            prune_threads(channel)
+        scanstate.save()
+        maybe_log_stats()
+
+
+# --- MAIN LOOP ---
+def run_polling():
+    last_state_save = time.time()
+
+    while True:
+        try:
+            channels_to_scan, im_channels = list_channels()
+            now = time.time()
+            for channel in channels_to_scan:
+                if channel_due(channel, now):
+                    submit_scan(channel, channel in im_channels)
+
+        except Exception as e:
+            print("Loop error:", e)
+
+        if time.time() - last_state_save >= POLL_INTERVAL:
+            last_state_save = time.time()
+            scanstate.save()
+        maybe_log_stats()
+
+        time.sleep(SCHEDULER_TICK)
+
 
-    time.sleep(POLL_INTERVAL)
+if APP_TOKEN and APP_TOKEN.startswith("xapp-"):
+    run_socket_mode()
+else:
+    if APP_TOKEN:
+        print("Warning: SLAVEWITHAI_APP_TOKEN is not an app-level token (xapp-...); falling back to polling.")
+    run_polling()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+from collections import OrderedDict
+
+# dedup loads (and rewrites) its log on import; keep that out of the repo
+os.environ.setdefault("DEDUP_FILE", os.path.join(tempfile.mkdtemp(), "processed_messages.log"))
+
+import pytest
+
+import dedup
+
+
+@pytest.fixture(autouse=True)
+def dedup_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "processed_messages.log")
+    monkeypatch.setattr(dedup, "DEDUP_FILE", path)
+    monkeypatch.setattr(dedup, "_seen", OrderedDict())
+    monkeypatch.setattr(dedup, "_log", None)
+    dedup._load()
+    yield path
+    dedup._log.close()
+
+
+def reload():
+    """Simulate a restart: forget everything in memory and read the log back."""
+    dedup._log.close()
+    dedup._seen.clear()
+    dedup._load()
+
+
+def log_ids(path):
+    with open(path) as f:
+        return [line.rstrip("\n").split("\t")[1] for line in f]
+
+
+def test_claim_drops_duplicates():
+    assert dedup.claim("C1-1.0")
+    assert not dedup.claim("C1-1.0")
+    assert not dedup.claim("C1-1.0", retry=1)
+    assert dedup.claim("C1-2.0")
+
+
+def test_claims_survive_a_restart(dedup_file):
+    dedup.claim("C1-1.0")
+    reload()
+    assert not dedup.claim("C1-1.0")
+    assert log_ids(dedup_file) == ["C1-1.0"]
+
+
+def test_expired_ids_are_claimed_again(monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(dedup.time, "time", lambda: now)
+    dedup.claim("C1-1.0")
+    now += dedup.DEDUP_TTL
+    assert dedup.claim("C1-1.0")
+
+
+def test_log_is_rewritten_with_only_kept_ids(dedup_file, monkeypatch):
+    monkeypatch.setattr(dedup, "DEDUP_MAX", 2)
+    for n in range(4):
+        dedup.claim(f"C1-{n}.0")
+    # the cap is applied before each claim, and again on load
+    assert list(dedup._seen) == ["C1-1.0", "C1-2.0", "C1-3.0"]
+    assert log_ids(dedup_file) == ["C1-0.0", "C1-1.0", "C1-2.0", "C1-3.0"]
+    reload()
+    assert list(dedup._seen) == ["C1-2.0", "C1-3.0"]
+    assert log_ids(dedup_file) == ["C1-2.0", "C1-3.0"]
+
+
+def test_log_is_compacted_after_enough_appends(dedup_file, monkeypatch):
+    monkeypatch.setattr(dedup, "DEDUP_COMPACT_MIN", 2)
+    monkeypatch.setattr(dedup, "DEDUP_MAX", 1)
+    for n in range(3):
+        dedup.claim(f"C1-{n}.0")
+    # the second append rewrote the log; the third went after it
+    assert log_ids(dedup_file) == ["C1-0.0", "C1-1.0", "C1-2.0"]
+    dedup.claim("C1-3.0")
+    assert log_ids(dedup_file) == ["C1-2.0", "C1-3.0"]
+
+
+def test_torn_lines_are_skipped(dedup_file):
+    with open(dedup_file, "w") as f:
+        f.write("1e12\tC1-1.0\nnot-a-time\tC1-2.0\n1e12\tC1-3")
+    reload()
+    assert list(dedup._seen) == ["C1-1.0", "C1-3"]
+
+
+def test_retry_num_reads_headers_and_socket_mode_body():
+    assert dedup.retry_num({"x-slack-retry-num": ["2"]}) == 2
+    assert dedup.retry_num({"x-slack-retry-num": "1"}) == 1
+    assert dedup.retry_num({}, {"retry_attempt": 3}) == 3
+    assert dedup.retry_num({"x-slack-retry-num": "nope"}) == 0
+    assert dedup.retry_num() == 0
@@ -0,0 +1,73 @@
+import json
+from collections import OrderedDict
+
+import pytest
+
+import history
+
+
+@pytest.fixture(autouse=True)
+def history_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "HISTORY_DIR", str(tmp_path))
+    monkeypatch.setattr(history, "HISTORY_SIZE", 3)
+    monkeypatch.setattr(history, "MESSAGE_HISTORY", OrderedDict())
+    monkeypatch.setattr(history, "_history_appends", {})
+    return tmp_path
+
+
+def log_lines(channel):
+    with open(history.history_path(channel)) as f:
+        return [json.loads(line) for line in f]
+
+
+def forget(channel):
+    history.MESSAGE_HISTORY.pop(channel)
+    history._history_appends.pop(channel, None)
+
+
+def test_appends_go_to_the_log_until_it_is_compacted():
+    history.append_channel_history("C1", "one")
+    history.append_channel_history("C1", "two")
+    assert log_lines("C1") == ["one", "two"]
+    history.append_channel_history("C1", "three")
+    # the third append since the last rewrite rewrites the log from the buffer
+    assert log_lines("C1") == ["one", "two", "three"]
+    assert history._history_appends["C1"] == 0
+    history.append_channel_history("C1", "four")
+    history.append_channel_history("C1", "five")
+    assert log_lines("C1") == ["one", "two", "three", "four", "five"]
+    history.append_channel_history("C1", "six")
+    assert log_lines("C1") == ["four", "five", "six"]
+    assert history.recent_history("C1") == ["four", "five", "six"]
+
+
+def test_reload_keeps_the_newest_messages_and_counts_stale_lines():
+    for text in ("one", "two", "three", "four", "multi\nline"):
+        history.append_channel_history("C1", text)
+    forget("C1")
+    assert history.recent_history("C1") == ["three", "four", "multi\nline"]
+    # two lines past HISTORY_SIZE, so one more append triggers the rewrite
+    assert history._history_appends["C1"] == 2
+    history.append_channel_history("C1", "six")
+    assert log_lines("C1") == ["four", "multi\nline", "six"]
+
+
+def test_torn_last_line_is_skipped(history_dir):
+    with open(history.history_path("C1"), "w") as f:
+        f.write('"one"\n"tw')
+    assert history.recent_history("C1") == ["one"]
+
+
+def test_legacy_txt_history_is_migrated(history_dir):
+    (history_dir / "channel_history_C1.txt").write_text("old one\n\nold two\n")
+    assert history.recent_history("C1") == ["old one", "old two"]
+    assert log_lines("C1") == ["old one", "old two"]
+    assert (history_dir / "channel_history_C1.txt.migrated").exists()
+
+
+def test_least_recently_used_channel_is_evicted(monkeypatch):
+    monkeypatch.setattr(history, "MAX_RESIDENT_CHANNELS", 2)
+    for channel in ("C1", "C2", "C1", "C3"):
+        history.append_channel_history(channel, f"hi {channel}")
+    assert list(history.MESSAGE_HISTORY) == ["C1", "C3"]
+    assert history.recent_history("C2") == ["hi C2"]
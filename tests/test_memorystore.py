@@ -0,0 +1,123 @@
+import pytest
+
+import memorystore
+
+
+@pytest.fixture(autouse=True)
+def store_files(tmp_path, monkeypatch):
+    for name, file in (
+        ("VECTORS_FILE", "store.npy"),
+        ("META_FILE", "store.meta.jsonl"),
+        ("LEGACY_FILE", "store.jsonl"),
+        ("ANN_FILE", "store.hnsw"),
+    ):
+        monkeypatch.setattr(memorystore, name, str(tmp_path / file))
+    monkeypatch.setattr(memorystore, "INITIAL_ROWS", 2)
+    monkeypatch.setenv("MEMORY_ANN", "0")
+    memorystore.close()
+    yield tmp_path
+    memorystore.close()
+
+
+def vec(i, dim=4):
+    v = [0.0] * dim
+    v[i % dim] = 1.0
+    return v
+
+
+def crash():
+    """Forget the loaded store without saving anything, like a killed process."""
+    memorystore._ann_unsaved = 0
+    memorystore.close()
+
+
+def test_store_grows_past_its_initial_rows():
+    for i in range(4):
+        assert memorystore.upsert(f"id{i}", vec(i), f"text{i}")
+    assert len(memorystore._vectors) == 4
+    assert memorystore.query(vec(3), top_k=1) == ["text3"]
+    assert memorystore.query(vec(0), top_k=10)[0] == "text0"
+
+
+def test_reupsert_replaces_vector_and_text():
+    memorystore.upsert("id0", vec(0), "old")
+    memorystore.upsert("id1", vec(1), "other")
+    memorystore.upsert("id0", vec(2), "new")
+    assert memorystore._count == 2
+    assert memorystore.query(vec(2), top_k=1) == ["new"]
+
+
+def test_store_is_reloaded_from_disk():
+    for i in range(3):
+        memorystore.upsert(f"id{i}", vec(i), f"text{i}")
+    memorystore.upsert("id1", vec(3), "updated1")
+    crash()
+    assert memorystore.query(vec(3), top_k=1) == ["updated1"]
+    assert memorystore._count == 3
+
+
+def test_dimension_mismatch_is_refused():
+    memorystore.upsert("id0", vec(0), "text0")
+    assert not memorystore.upsert("id1", vec(1, dim=3), "text1")
+
+
+@pytest.fixture
+def ann(monkeypatch):
+    pytest.importorskip("hnswlib")
+    monkeypatch.setenv("MEMORY_ANN", "1")
+    monkeypatch.setattr(memorystore, "ANN_MIN_ITEMS", 3)
+    monkeypatch.setattr(memorystore, "ANN_SAVE_EVERY", 1000)
+
+
+def test_index_is_built_once_the_store_is_big_enough(ann, store_files):
+    memorystore.upsert("id0", vec(0), "text0")
+    memorystore.upsert("id1", vec(1), "text1")
+    assert memorystore._ann_index is None
+    memorystore.upsert("id2", vec(2), "text2")
+    assert memorystore._ann_index.get_current_count() == 3
+    assert (store_files / "store.hnsw").exists()
+    memorystore.upsert("id3", vec(3), "text3")
+    assert memorystore.query(vec(3), top_k=1) == ["text3"]
+
+
+def test_updates_after_the_last_index_save_survive_a_crash(ann):
+    for i in range(4):
+        memorystore.upsert(f"id{i}", vec(i, dim=8), f"text{i}")
+    # the index was saved with 3 rows; row 3 and the update come after it
+    memorystore.upsert("id1", vec(5, dim=8), "updated1")
+    crash()
+    assert memorystore.query(vec(5, dim=8), top_k=1) == ["updated1"]
+    assert memorystore.query(vec(3, dim=8), top_k=1) == ["text3"]
+    assert memorystore._ann_index is not None
+
+
+def test_close_saves_the_index(ann, store_files):
+    for i in range(3):
+        memorystore.upsert(f"id{i}", vec(i), f"text{i}")
+    memorystore.upsert("id0", vec(3), "updated0")
+    memorystore.close()
+    saved = (store_files / "store.hnsw").stat().st_mtime_ns
+    assert memorystore.query(vec(3), top_k=1) == ["updated0"]
+    assert memorystore._ann_index.get_current_count() == 3
+    assert (store_files / "store.hnsw").stat().st_mtime_ns == saved
+
+
+def test_index_is_rebuilt_when_it_does_not_match_the_store(ann, store_files):
+    for i in range(4):
+        memorystore.upsert(f"id{i}", vec(i), f"text{i}")
+    memorystore.close()
+    # the side table lost its last row, the index still has it
+    meta = store_files / "store.meta.jsonl"
+    meta.write_text("".join(meta.read_text().splitlines(keepends=True)[:3]))
+    assert memorystore.query(vec(2), top_k=1) == ["text2"]
+    assert memorystore._count == 3
+    assert memorystore._ann_index.get_current_count() == 3
+
+
+def test_index_without_a_saved_offset_is_rebuilt(ann, store_files):
+    for i in range(3):
+        memorystore.upsert(f"id{i}", vec(i), f"text{i}")
+    memorystore.upsert("id0", vec(3), "updated0")
+    crash()
+    (store_files / "store.hnsw.json").unlink()
+    assert memorystore.query(vec(3), top_k=1) == ["updated0"]
@@ -0,0 +1,57 @@
+import pytest
+
+import ratelimit
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    monkeypatch.setattr(ratelimit, "_buckets", {})
+    return clock
+
+
+def test_bucket_allows_a_burst_then_refills_at_the_tier_rate(clock):
+    # tier 2 is 20 calls a minute: a bucket of 10 seconds' worth, then one per 3s
+    for _ in range(3):
+        assert ratelimit.acquire("conversations_list", wait=False)
+    assert not ratelimit.acquire("conversations_list", wait=False)
+    clock.now += 3
+    assert ratelimit.acquire("conversations_list", wait=False)
+    assert not ratelimit.acquire("conversations_list", wait=False)
+
+
+def test_blocking_acquire_sleeps_until_a_token_is_free(clock):
+    for _ in range(3):
+        ratelimit.acquire("conversations_list")
+    assert ratelimit.acquire("conversations_list")
+    assert sum(clock.slept) == pytest.approx(2)
+
+
+def test_buckets_are_per_method(clock):
+    for _ in range(3):
+        ratelimit.acquire("conversations_list")
+    assert ratelimit.acquire("users_list", wait=False)
+
+
+def test_block_holds_the_method_for_retry_after(clock):
+    ratelimit.acquire("chat_update")
+    ratelimit.block("chat_update", 30)
+    assert not ratelimit.acquire("chat_update", wait=False)
+    clock.now += 29
+    assert not ratelimit.acquire("chat_update", wait=False)
+    assert ratelimit.acquire("chat_update")
+    assert clock.now >= 1030
@@ -0,0 +1,33 @@
+from reactions import parse_json_reply, plain_reply, split_reaction_header
+
+
+def test_header_is_split_off():
+    assert split_reaction_header("reaction: :skulk:\nwow. groundbreaking.") == ("wow. groundbreaking.", "skulk")
+
+
+def test_header_still_arriving_hides_the_text():
+    assert split_reaction_header("reac") == (None, None)
+    assert split_reaction_header("Reaction: sku") == (None, None)
+
+
+def test_reply_without_header_is_shown_as_is():
+    assert split_reaction_header("no header here") == ("no header here", None)
+
+
+def test_json_reply_in_a_code_fence():
+    raw = '```json\n{"reply": "sure, \\"genius\\"", "reaction": "pf"}\n```'
+    assert parse_json_reply(raw) == ('sure, "genius"', "pf")
+
+
+def test_cut_off_json_still_gives_the_reply():
+    raw = '{"reaction": "heavysob", "reply": "line one\\nline tw'
+    assert parse_json_reply(raw) == ("line one\nline tw", "heavysob")
+
+
+def test_not_json_at_all():
+    assert parse_json_reply("just words") == (None, None)
+    assert parse_json_reply('{"reply": ""}') == (None, None)
+
+
+def test_plain_reply_strips_the_fence():
+    assert plain_reply("```\njust words\n```") == "just words"
@@ -0,0 +1,189 @@
+import pytest
+
+import scanstate
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(tmp_path):
+    scanstate.load(str(tmp_path / "missing.json"))
+
+
+def history(*pages):
+    """A fake slack_call serving `pages` of conversations.history in turn."""
+    calls = []
+    pages = list(pages)
+
+    def call(method, **kwargs):
+        calls.append((method, kwargs))
+        return pages.pop(0)
+
+    return call, calls
+
+
+def page(*ts, cursor=None):
+    return {
+        "ok": True,
+        "messages": [{"ts": t} for t in reversed(ts)],
+        "has_more": bool(cursor),
+        "response_metadata": {"next_cursor": cursor or ""},
+    }
+
+
+def test_first_fetch_gets_one_page_without_oldest():
+    call, calls = history(page("1.0", "2.0", cursor="next"))
+    assert [m["ts"] for m in scanstate.fetch_channel_window(call, "C1")] == ["1.0", "2.0"]
+    assert len(calls) == 1
+    assert "oldest" not in calls[0][1]
+
+
+def test_fetch_starts_at_watermark_even_with_old_watched_threads():
+    scanstate.state["watermarks"]["C1"] = "100.0"
+    scanstate.watch_thread("C1", "5.0")
+    call, calls = history(page("100.0", "101.0"))
+    assert [m["ts"] for m in scanstate.fetch_channel_window(call, "C1")] == ["101.0"]
+    assert calls[0][1]["oldest"] == "100.0"
+    assert "inclusive" not in calls[0][1]
+
+
+def test_fetch_follows_cursor_from_watermark():
+    scanstate.state["watermarks"]["C1"] = "100.0"
+    call, calls = history(page("103.0", "104.0", cursor="c2"), page("101.0", "102.0"))
+    messages = scanstate.fetch_channel_window(call, "C1")
+    assert [m["ts"] for m in messages] == ["101.0", "102.0", "103.0", "104.0"]
+    assert calls[1][1]["cursor"] == "c2"
+    assert all(kwargs["oldest"] == "100.0" for _, kwargs in calls)
+
+
+def test_fetch_error_returns_none():
+    call, _ = history({"ok": False, "error": "ratelimited"})
+    assert scanstate.fetch_channel_window(call, "C1") is None
+
+
+def test_only_threads_with_replies_are_watched():
+    assert not scanstate.has_thread({"ts": "1.0"})
+    assert scanstate.has_thread({"ts": "1.0", "thread_ts": "1.0", "reply_count": 2, "latest_reply": "3.0"})
+    assert scanstate.has_thread({"ts": "2.0", "thread_ts": "1.0", "subtype": "thread_broadcast"})
+
+
+def parents(*threads, cursor=None):
+    """A conversations.history page of (ts, latest_reply) parents, newest first."""
+    result = page(cursor=cursor)
+    result["messages"] = [
+        {"ts": ts, "thread_ts": ts, "latest_reply": latest} if latest else {"ts": ts}
+        for ts, latest in reversed(threads)
+    ]
+    return result
+
+
+def test_sweep_only_picks_threads_whose_latest_reply_moved():
+    scanstate.watch_thread("C1", "1.0", "3.0")
+    scanstate.watch_thread("C1", "2.0", "4.0")
+    call, calls = history(parents(("1.0", "3.0"), ("2.0", "5.0")))
+    assert scanstate.threads_to_sweep(call, "C1", now=1000) == ["2.0"]
+    assert len(calls) == 1
+    assert calls[0][1]["oldest"] == "1.0"
+
+
+def test_sweep_waits_for_its_interval():
+    scanstate.watch_thread("C1", "1.0")
+    call, calls = history(parents(("1.0", "2.0")), parents(("1.0", "2.0")))
+    assert scanstate.threads_to_sweep(call, "C1", now=1000) == ["1.0"]
+    assert scanstate.threads_to_sweep(call, "C1", now=1000 + scanstate.THREAD_SWEEP_INTERVAL - 1) == []
+    assert len(calls) == 1
+    assert scanstate.threads_to_sweep(call, "C1", now=1000 + scanstate.THREAD_SWEEP_INTERVAL) == ["1.0"]
+
+
+def test_thread_started_after_its_parent_was_scanned_is_swept():
+    # the parent came and went through the history scan without replies
+    scanstate.state["watermarks"]["C1"] = "1001.0"
+    call, _ = history(parents(("1001.0", None)))
+    assert scanstate.threads_to_sweep(call, "C1", now=1002) == []
+    # then someone triggers the bot in a reply to it
+    call, _ = history(parents(("1001.0", "1005.0")))
+    assert scanstate.threads_to_sweep(call, "C1", now=1012) == ["1001.0"]
+    replies = {
+        "ok": True,
+        "messages": [
+            {"ts": "1001.0", "latest_reply": "1005.0"},
+            {"ts": "1005.0", "user": "U1", "text": "hey greg"},
+        ],
+    }
+    new = scanstate.sync_thread(lambda method, **kw: replies, "C1", "1001.0")
+    assert [r["ts"] for r in new] == ["1005.0"]
+
+
+def test_first_sweep_does_not_replay_old_threads():
+    call, _ = history(parents(("1.0", "2.0")), parents(("1.0", "2.0")))
+    assert scanstate.threads_to_sweep(call, "C1", now=1000) == []
+    assert scanstate.threads_to_sweep(call, "C1", now=2000) == []
+    assert "1.0" not in scanstate.state["threads"]["C1"]
+
+
+def test_sweep_pages_back_to_the_oldest_watched_parent(monkeypatch):
+    monkeypatch.setattr(scanstate, "THREAD_SWEEP_PAGES", 2)
+    scanstate.watch_thread("C1", "1.0")
+    call, calls = history(
+        parents(("5.0", None), cursor="c2"), parents(("1.0", "2.0"), cursor="c3"), parents()
+    )
+    assert scanstate.threads_to_sweep(call, "C1", now=1000) == ["1.0"]
+    assert len(calls) == 2
+    assert calls[1][1]["cursor"] == "c2"
+
+
+def test_sync_thread_skips_unchanged_latest_reply():
+    scanstate.watch_thread("C1", "1.0", "3.0")
+    replies = {"ok": True, "messages": [{"ts": "1.0", "latest_reply": "3.0"}, {"ts": "3.0"}]}
+    assert scanstate.sync_thread(lambda method, **kw: replies, "C1", "1.0") == []
+
+
+def test_sync_thread_returns_new_replies_and_records_bot():
+    scanstate.watch_thread("C1", "1.0", "2.0")
+    replies = {
+        "ok": True,
+        "messages": [
+            {"ts": "1.0", "latest_reply": "4.0"},
+            {"ts": "4.0", "user": "UBOT"},
+            {"ts": "3.0", "user": "U1"},
+        ],
+    }
+    new = scanstate.sync_thread(lambda method, **kw: replies, "C1", "1.0", "UBOT")
+    assert [r["ts"] for r in new] == ["3.0", "4.0"]
+    assert scanstate.state["threads"]["C1"]["1.0"] == "4.0"
+    assert scanstate.already_replied("C1", "1.0", "3.5")
+
+
+def test_prune_drops_expired_threads():
+    now = 10 * scanstate.THREAD_WATCH_SECONDS
+    old, live = str(now - scanstate.THREAD_WATCH_SECONDS - 1), str(now - 1)
+    scanstate.watch_thread("C1", old)
+    scanstate.watch_thread("C1", live)
+    scanstate.prune_threads("C1", now=now)
+    assert list(scanstate.state["threads"]["C1"]) == [live]
+
+
+def test_bot_reply_check_leaves_replies_for_the_sweep():
+    scanstate.watch_thread("C1", "100.0")
+    replies = {
+        "ok": True,
+        "messages": [
+            {"ts": "100.0", "latest_reply": "102.0"},
+            {"ts": "101.0", "user": "U1", "text": "greg say hi"},
+            {"ts": "102.0", "user": "U2", "subtype": "thread_broadcast"},
+        ],
+    }
+    call = lambda method, **kw: replies
+    scanstate.sync_thread(call, "C1", "100.0", "UBOT", advance=False)
+    assert scanstate.state["threads"]["C1"]["100.0"] == "100.0"
+    sweep, _ = history(parents(("100.0", "102.0")))
+    assert scanstate.threads_to_sweep(sweep, "C1", now=1000) == ["100.0"]
+    assert [r["ts"] for r in scanstate.sync_thread(call, "C1", "100.0", "UBOT")] == ["101.0", "102.0"]
+
+
+def test_seed_watermark_only_starts_unscanned_channels():
+    scanstate.state["watermarks"]["C1"] = "100.0"
+    scanstate.seed_watermark("C1", now=500)
+    scanstate.seed_watermark("C2", now=500)
+    assert scanstate.state["watermarks"] == {"C1": "100.0", "C2": "500.000000"}
+    call, calls = history(page("600.0"))
+    assert [m["ts"] for m in scanstate.fetch_channel_window(call, "C2")] == ["600.0"]
+    assert calls[0][1]["oldest"] == "500.000000"
@@ -0,0 +1,30 @@
+from triggers import GREG_TRIGGERS, compile_router, route
+
+
+def test_each_persona_routes():
+    router = compile_router()
+    assert route(router, "hey greg") == ["greg"]
+    assert route(router, "GEOFF are you there") == ["geoff"]
+    assert route(router, "what's my slack id?") == ["slack_id"]
+    assert route(router, "nothing to see here") == []
+
+
+def test_every_greg_trigger_matches():
+    router = compile_router("greg")
+    for trigger in GREG_TRIGGERS:
+        assert route(router, f"well {trigger.upper()} then") == ["greg"]
+
+
+def test_personas_in_order_of_first_appearance_without_repeats():
+    router = compile_router()
+    assert route(router, "geoff, greg and geoff again, greg") == ["geoff", "greg"]
+
+
+def test_router_only_knows_the_named_personas():
+    router = compile_router("slack_id")
+    assert route(router, "greg whats my id") == ["slack_id"]
+    assert route(router, "greg") == []
+
+
+def test_route_handles_missing_text():
+    assert route(compile_router(), None) == []
@@ -0,0 +1,116 @@
+import functools
+import os
+import threading
+import time
+
+# Langfuse tracing for the bots, set up so it can never slow a reply down:
+# spans are exported in batches by a background thread, and that exporter's
+# queue is bounded, so under backpressure spans are dropped instead of blocking
+# the caller. Every trace is recorded unless LANGFUSE_SAMPLE_RATE samples them.
+
+TRACE_SAMPLE_RATE = 1.0  # default for LANGFUSE_SAMPLE_RATE: trace everything
+TRACE_FLUSH_AT = 64  # spans per export batch
+TRACE_FLUSH_INTERVAL = 5  # seconds between background exports
+TRACE_QUEUE_SIZE = 2048  # spans buffered before new ones are dropped
+TRACE_STATS_INTERVAL = 60 * 10  # seconds between overhead lines in the log
+
+# read by the exporter's BatchSpanProcessor when it is created
+os.environ.setdefault("OTEL_BSP_MAX_QUEUE_SIZE", str(TRACE_QUEUE_SIZE))
+
+try:
+    from langfuse import Langfuse
+    from langfuse import observe as _langfuse_observe
+except ImportError:
+    Langfuse = None
+    _langfuse_observe = None
+
+_client = None
+_client_lock = threading.Lock()
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "overhead": 0.0, "max_overhead": 0.0, "logged": time.time()}
+
+
+def _sample_rate():
+    # read when used, not on import: the bots import this before load_dotenv()
+    return float(os.environ.get("LANGFUSE_SAMPLE_RATE", TRACE_SAMPLE_RATE))
+
+
+def _ensure_client():
+    # created on first use so bots that call load_dotenv() after their imports
+    # still get the keys; @observe picks this client up through get_client()
+    global _client
+    if _client is not None or Langfuse is None:
+        return
+    with _client_lock:
+        if _client is not None:
+            return
+        try:
+            _client = Langfuse(
+                sample_rate=_sample_rate(),
+                flush_at=TRACE_FLUSH_AT,
+                flush_interval=TRACE_FLUSH_INTERVAL,
+            )
+        except Exception as e:
+            print("Warning: could not set up Langfuse tracing:", e)
+            _client = False
+
+
+def tracing_stats():
+    """Calls traced so far and the time tracing added to them."""
+    with _stats_lock:
+        calls = _stats["calls"]
+        return {
+            "calls": calls,
+            "sample_rate": _sample_rate(),
+            "avg_overhead_ms": round(_stats["overhead"] / calls * 1000, 3) if calls else 0.0,
+            "max_overhead_ms": round(_stats["max_overhead"] * 1000, 3),
+        }
+
+
+def _record(overhead):
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["overhead"] += overhead
+        _stats["max_overhead"] = max(_stats["max_overhead"], overhead)
+        if time.time() - _stats["logged"] < TRACE_STATS_INTERVAL:
+            return
+        _stats["logged"] = time.time()
+    print("Tracing:", tracing_stats())
+
+
+def observe(func=None, **kwargs):
+    """Drop-in for langfuse's @observe that also measures its own overhead.
+
+    The overhead of a call is its total time minus the time spent in the
+    decorated function itself.
+    """
+    if func is None:
+        return lambda f: observe(f, **kwargs)
+    if _langfuse_observe is None:
+        return func
+
+    @functools.wraps(func)
+    def timed(*args, **kw):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kw)
+        finally:
+            _local.inner[-1] += time.perf_counter() - start
+
+    traced = _langfuse_observe(**kwargs)(timed)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kw):
+        _ensure_client()
+        if not hasattr(_local, "inner"):
+            _local.inner = []
+        _local.inner.append(0.0)
+        start = time.perf_counter()
+        try:
+            return traced(*args, **kw)
+        finally:
+            total = time.perf_counter() - start
+            _record(max(0.0, total - _local.inner.pop()))
+
+    return wrapper
@@ -0,0 +1,23 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+# One requests session for every outbound HTTP call, so connections to the AI
+# proxy and Last.fm are kept alive and reused instead of paying a TCP + TLS
+# handshake per call. Slack goes through slack_sdk's WebClient, which has no
+# connection pool of its own; each bot shares a single WebClient instead.
+
+AI_PROXY_URL = "https://ai.hackclub.com/"
+LASTFM_URL = "http://ws.audioscrobbler.com/"
+
+# idle connections kept per host; sized for the busiest caller (bolt's listener
+# pool plus slavewithai's scan and reply workers). Extra concurrent requests
+# still go through, their connections just are not kept afterwards.
+AI_POOL_SIZE = 16
+LASTFM_POOL_SIZE = 2
+DEFAULT_POOL_SIZE = 4
+
+http_session = requests.Session()
+http_session.mount(AI_PROXY_URL, HTTPAdapter(pool_maxsize=AI_POOL_SIZE))
+http_session.mount(LASTFM_URL, HTTPAdapter(pool_maxsize=LASTFM_POOL_SIZE))
+http_session.mount("https://", HTTPAdapter(pool_maxsize=DEFAULT_POOL_SIZE))
+http_session.mount("http://", HTTPAdapter(pool_maxsize=DEFAULT_POOL_SIZE))
@@ -0,0 +1,58 @@
+import re
+
+# Trigger phrases for every persona, compiled into a single pattern so a message
+# is scanned once no matter how many personas or phrases there are.
+# The docker images are built from the repo root so every bot that routes
+# triggers copies this file.
+
+# greg / slack annoyance (lowercase, matched case-insensitively)
+GREG_TRIGGERS = [
+    "assistant",
+    "slave",
+    "servant",
+    "unwanted ai",
+    "clanker",
+    "clanka",
+    "grok is this true",
+    "slack annoyance",
+    "u0a1k6rv4lc",
+    "@u0a1k6rv4lc",
+    "<@u0a1k6rv4lc>",
+    "@slack annoyance",
+    "greg",
+]
+
+GEOFF_TRIGGERS = ["geoff"]
+
+# persona -> regex alternatives. use (?:...) for grouping, a capturing group
+# would hide which persona matched
+PERSONAS = {
+    "greg": [re.escape(t) for t in GREG_TRIGGERS],
+    "geoff": [re.escape(t) for t in GEOFF_TRIGGERS],
+    "slack_id": [
+        r"what(?:'?s| is) my (?:slack )?id",
+        r"my slack id",
+        r"slack id",
+        r"whats my id",
+        r"who am i",
+        r"what am i",
+    ],
+}
+
+
+def compile_router(*names):
+    """Compile the named personas (default: all) into one case-insensitive pattern."""
+    names = names or tuple(PERSONAS)
+    return re.compile(
+        "|".join(f"(?P<{name}>{'|'.join(PERSONAS[name])})" for name in names),
+        re.IGNORECASE,
+    )
+
+
+def route(router, text):
+    """Return the personas triggered by `text`, in order of first appearance."""
+    found = []
+    for m in router.finditer(text or ""):
+        if m.lastgroup not in found:
+            found.append(m.lastgroup)
+    return found